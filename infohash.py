@@ -0,0 +1,99 @@
+from hashlib import sha1, sha256
+from base64 import b32decode
+from urllib.parse import urlparse, parse_qs
+
+
+def bdecode(data, i=0):
+    c = data[i : i + 1]
+    if c == b"i":
+        end = data.index(b"e", i)
+        return int(data[i + 1 : end]), end + 1
+    if c == b"l":
+        i, items = i + 1, []
+        while data[i : i + 1] != b"e":
+            item, i = bdecode(data, i)
+            items.append(item)
+        return items, i + 1
+    if c == b"d":
+        i, items = i + 1, {}
+        while data[i : i + 1] != b"e":
+            key, i = bdecode(data, i)
+            if not isinstance(key, bytes):
+                raise ValueError(f"Invalid dictionary key at offset {i}")
+            items[key], i = bdecode(data, i)
+        return items, i + 1
+    if c.isdigit():
+        colon = data.index(b":", i)
+        start = colon + 1
+        end = start + int(data[i:colon])
+        if end > len(data):
+            raise ValueError("Truncated bencoded string")
+        return data[start:end], end
+    raise ValueError(f"Invalid bencoded data at offset {i}")
+
+
+def info_span(data):
+    if data[:1] != b"d":
+        raise ValueError("Torrent metainfo is not a dictionary")
+    i = 1
+    while data[i : i + 1] != b"e":
+        key, i = bdecode(data, i)
+        start = i
+        _, i = bdecode(data, i)
+        if key == b"info":
+            return start, i
+    raise ValueError("Missing info dictionary")
+
+
+def info_dict(data):
+    start, end = info_span(data)
+    info, _ = bdecode(data, start)
+    if not isinstance(info, dict):
+        raise ValueError("Torrent info is not a dictionary")
+    return info, start, end
+
+
+def from_torrent(data):
+    info, start, end = info_dict(data)
+    if b"pieces" in info:
+        return sha1(data[start:end]).hexdigest()
+    return sha256(data[start:end]).hexdigest()[:40]
+
+
+def from_magnet(magnet):
+    topics = parse_qs(urlparse(magnet).query).get("xt", [])
+    for xt in topics:
+        if xt.lower().startswith("urn:btih:"):
+            value = xt[9:]
+            if len(value) == 32:
+                return b32decode(value.upper()).hex()
+            if len(value) == 40:
+                return value.lower()
+    for xt in topics:
+        if xt.lower().startswith("urn:btmh:1220"):
+            return xt[13:53].lower()
+    raise ValueError(f"No info hash in magnet link: '{magnet}'")
+
+
+def torrent_size(data):
+    info, _, _ = info_dict(data)
+    try:
+        return file_sizes(info)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid file sizes in torrent info: {e}")
+
+
+def file_sizes(info):
+    if b"length" in info:
+        return info[b"length"]
+    if b"files" in info:
+        return sum(f[b"length"] for f in info[b"files"])
+    size = 0
+    stack = [info.get(b"file tree", {})]
+    while stack:
+        for key, node in stack.pop().items():
+            if key == b"" and b"length" in node:
+                size += node[b"length"]
+            elif isinstance(node, dict):
+                stack.append(node)
+    return size
@@ -0,0 +1,77 @@
+import os
+import json
+from os import path
+from threading import Lock
+from logging import getLogger
+
+logger = getLogger("rich")
+
+
+class Journal:
+    def __init__(self, file, compact_after=200):
+        self.file = file
+        self.compact_after = compact_after
+        self.records = {}
+        self.lines = 0
+        self.lock = Lock()
+
+    def load(self):
+        records, lines = {}, 0
+        if path.exists(self.file):
+            with open(self.file) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Journal - skipped torn line in '{self.file}'")
+                        continue
+                    lines += 1
+                    key = entry.pop("key")
+                    op = entry.pop("op")
+                    if op == "add":
+                        records[key] = entry
+                    elif op == "update" and key in records:
+                        records[key].update(entry)
+                    elif op == "remove":
+                        records.pop(key, None)
+        with self.lock:
+            self.records, self.lines = records, lines
+            self.compact()
+        return {key: dict(record) for key, record in records.items()}
+
+    def add(self, key, **record):
+        self.append("add", key, record)
+
+    def update(self, key, **fields):
+        self.append("update", key, fields)
+
+    def remove(self, key):
+        self.append("remove", key, {})
+
+    def append(self, op, key, fields):
+        with self.lock:
+            if op == "add":
+                self.records[key] = dict(fields)
+            elif key not in self.records:
+                return
+            elif op == "update":
+                self.records[key].update(fields)
+            else:
+                del self.records[key]
+            with open(self.file, "a") as f:
+                f.write(json.dumps(dict(fields, op=op, key=key)) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.lines += 1
+            if self.lines > self.compact_after + len(self.records):
+                self.compact()
+
+    def compact(self):
+        temp = f"{self.file}.tmp"
+        with open(temp, "w") as f:
+            for key, record in self.records.items():
+                f.write(json.dumps(dict(record, op="add", key=key)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.file)
+        self.lines = len(self.records)
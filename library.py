@@ -0,0 +1,473 @@
+import os
+import ctypes
+import ctypes.util
+import sqlite3
+import struct
+from contextlib import closing
+from os import path, scandir
+from shutil import disk_usage
+from select import select
+from stat import S_ISDIR
+from threading import Thread, Event, Lock
+from time import time as now
+from logging import getLogger
+
+logger = getLogger("rich")
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+IGNORED = ["System Volume Information", "$RECYCLE.BIN"]
+FIELDS = [
+    "name",
+    "disk",
+    "root",
+    "path",
+    "is_dir",
+    "size",
+    "mtime",
+    "subtitles",
+    "subs_dir",
+    "largest",
+]
+
+
+def opensubtitles_hash(file, size, chunk=64 * 1024):
+    if size < 2 * chunk:
+        return None
+    fd = os.open(file, os.O_RDONLY)
+    try:
+        data = os.pread(fd, chunk, 0) + os.pread(fd, chunk, size - chunk)
+    finally:
+        os.close(fd)
+    total = size + sum(struct.unpack(f"<{len(data) // 8}Q", data))
+    return f"{total & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
+def visible(name):
+    return (
+        name not in IGNORED and not name.endswith(".srt") and not name.startswith(".")
+    )
+
+
+class Inotify:
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def add(self, folder, tag):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_MASK)
+        if wd >= 0:
+            self.watches[wd] = tag
+
+    def read(self, timeout):
+        if not select([self.fd], [], [], timeout)[0]:
+            return []
+        data, offset, events = os.read(self.fd, 64 * 1024), 0, []
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16 : offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            events.append((self.watches.get(wd), mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Library:
+    def __init__(
+        self, roots, snapshot=None, rescan_interval=300, debounce=1, save_interval=60
+    ):
+        self.roots = [(disk, root) for disk, root in roots if root]
+        self.snapshot = snapshot
+        self.rescan_interval = rescan_interval
+        self.debounce = debounce
+        self.save_interval = save_interval
+        self.entries = {}
+        self.hashes = {}
+        self.version = 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.inotify = None
+        self.dirty = set()
+        self.saved = 0
+
+    def start(self):
+        if self.snapshot:
+            self.load()
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Library - inotify unavailable, polling only: {e}")
+            self.rescan_interval = min(self.rescan_interval, 60)
+        if not self.entries:
+            self.rescan()
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        try:
+            self.save()
+        except Exception as e:
+            logger.warning(f"Library - snapshot failed: {e}")
+
+    def run(self):
+        last_scan = 0 if self.entries and self.snapshot else now()
+        first_dirty, last_save = None, now()
+        while not self.stopped.is_set():
+            if self.inotify:
+                for tag, mask, name in self.inotify.read(self.debounce):
+                    if mask & IN_Q_OVERFLOW:
+                        last_scan = 0
+                    elif tag:
+                        self.on_event(tag, mask, name)
+            else:
+                self.stopped.wait(self.debounce)
+            if self.dirty and first_dirty is None:
+                first_dirty = now()
+            try:
+                if now() - last_scan > self.rescan_interval:
+                    last_scan, first_dirty = now(), None
+                    self.rescan()
+                elif first_dirty and now() - first_dirty >= self.debounce:
+                    self.flush()
+                    first_dirty = None
+                if now() - last_save >= self.save_interval:
+                    self.save()
+                    last_save = now()
+            except Exception as e:
+                logger.warning(f"Library - refresh failed: {e}")
+
+    def on_event(self, tag, mask, name):
+        disk, root, top = tag
+        if top is None:
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                return
+            top = name
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch(disk, root, path.join(root, name), name)
+        elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self.watch(disk, root, path.join(root, top, name), top)
+        if visible(top):
+            self.dirty.add((disk, top))
+        elif top.endswith(".srt"):
+            self.dirty.update(
+                (disk, name) for name in self.names(disk, path.splitext(top)[0])
+            )
+
+    def watch(self, disk, root, folder, top=None):
+        if not self.inotify:
+            return
+        self.inotify.add(folder, (disk, root, top))
+        try:
+            for entry in scandir(folder):
+                if entry.is_dir(follow_symlinks=False):
+                    self.watch(disk, root, entry.path, top or entry.name)
+        except OSError:
+            pass
+
+    def names(self, disk, stem):
+        with self.lock:
+            return [
+                e["name"]
+                for e in self.entries.values()
+                if e["disk"] == disk and path.splitext(e["name"])[0] == stem
+            ]
+
+    def stat_entry(self, disk, root, name, srt=None):
+        file = path.join(root, name)
+        try:
+            st = os.stat(file)
+        except OSError:
+            return None
+        entry = dict(
+            name=name,
+            disk=disk,
+            root=root,
+            path=file,
+            is_dir=S_ISDIR(st.st_mode),
+            size=st.st_size,
+            mtime=st.st_mtime,
+            subtitles=False,
+            subs_dir=False,
+            largest=None,
+        )
+        if entry["is_dir"]:
+            size, largest = 0, 0
+            try:
+                children = list(scandir(file))
+            except OSError:
+                children = []
+            for child in children:
+                try:
+                    if child.is_dir(follow_symlinks=False):
+                        entry["subs_dir"] |= child.name == "Subs"
+                        size += self.tree_size(child.path)
+                        continue
+                    s = child.stat().st_size
+                except OSError:
+                    continue
+                size += s
+                if child.name.endswith(".srt"):
+                    entry["subtitles"] = True
+                elif s > largest:
+                    entry["largest"], largest = child.name, s
+            entry["size"] = size
+        elif srt is not None:
+            entry["subtitles"] = path.splitext(name)[0] in srt
+        else:
+            entry["subtitles"] = path.isfile(file[:-3] + "srt")
+        return entry
+
+    def tree_size(self, folder):
+        size = 0
+        try:
+            children = list(scandir(folder))
+        except OSError:
+            return 0
+        for child in children:
+            try:
+                if child.is_dir(follow_symlinks=False):
+                    size += self.tree_size(child.path)
+                else:
+                    size += child.stat().st_size
+            except OSError:
+                continue
+        return size
+
+    def rescan(self):
+        entries = {}
+        for disk, root in self.roots:
+            if not path.isdir(root):
+                continue
+            names = [e.name for e in scandir(root)]
+            srt = {path.splitext(n)[0] for n in names if n.endswith(".srt")}
+            for name in filter(visible, names):
+                entry = self.stat_entry(disk, root, name, srt)
+                if entry:
+                    entries[(disk, name)] = entry
+            self.watch(disk, root, root)
+        with self.lock:
+            changed = entries != self.entries
+            self.entries = entries
+            self.dirty.clear()
+            if changed:
+                self.version += 1
+
+    def flush(self):
+        dirty, self.dirty = self.dirty, set()
+        for disk, name in dirty:
+            self.update(disk, name)
+
+    def update(self, disk, name):
+        root = dict(self.roots).get(disk)
+        entry = self.stat_entry(disk, root, name) if root else None
+        with self.lock:
+            if entry == self.entries.get((disk, name)):
+                return entry
+            if entry:
+                self.entries[(disk, name)] = entry
+            else:
+                self.entries.pop((disk, name), None)
+            self.version += 1
+        return entry
+
+    def get(self, name, disk=None):
+        with self.lock:
+            for d, _ in self.roots:
+                if disk in [None, d] and (d, name) in self.entries:
+                    return dict(self.entries[(d, name)])
+
+    def find(self, file_path):
+        folder, name = path.split(path.normpath(file_path))
+        for disk, root in self.roots:
+            if path.normpath(root) == folder:
+                with self.lock:
+                    entry = self.entries.get((disk, name))
+                    return dict(entry) if entry else None
+
+    def moviehash(self, file):
+        st = os.stat(file)
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        with self.lock:
+            if key in self.hashes:
+                return self.hashes[key]
+        value = opensubtitles_hash(file, st.st_size)
+        with self.lock:
+            self.hashes[key] = value
+        if self.snapshot and value:
+            with closing(sqlite3.connect(self.snapshot)) as db, db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS hashes (inode INTEGER, size INTEGER, mtime REAL, hash TEXT, PRIMARY KEY (inode, size, mtime))"
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)", (*key, value)
+                )
+        return value
+
+    def list(self, disk=None):
+        with self.lock:
+            entries = [
+                dict(e) for e in self.entries.values() if disk in [None, e["disk"]]
+            ]
+        order = [d for d, _ in self.roots]
+        return sorted(
+            entries, key=lambda e: (order.index(e["disk"]), e["name"].capitalize())
+        )
+
+    def load(self):
+        try:
+            with closing(sqlite3.connect(self.snapshot)) as db:
+                hashes = db.execute("SELECT inode, size, mtime, hash FROM hashes")
+                self.hashes = {tuple(row[:3]): row[3] for row in hashes}
+        except sqlite3.Error:
+            pass
+        try:
+            with closing(sqlite3.connect(self.snapshot)) as db:
+                rows = db.execute(f"SELECT {', '.join(FIELDS)} FROM entries").fetchall()
+        except sqlite3.Error:
+            return
+        roots = dict(self.roots)
+        with self.lock:
+            for row in rows:
+                entry = dict(zip(FIELDS, row))
+                entry["is_dir"] = bool(entry["is_dir"])
+                entry["subtitles"] = bool(entry["subtitles"])
+                entry["subs_dir"] = bool(entry["subs_dir"])
+                if roots.get(entry["disk"]) == entry["root"]:
+                    self.entries[(entry["disk"], entry["name"])] = entry
+            self.version += 1
+        logger.info(f"Library - {len(self.entries)} entries loaded from snapshot")
+
+    def save(self):
+        if not self.snapshot or self.saved == self.version:
+            return
+        with self.lock:
+            rows = [tuple(e[f] for f in FIELDS) for e in self.entries.values()]
+            version = self.version
+        with closing(sqlite3.connect(self.snapshot)) as db, db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (name TEXT, disk TEXT, root TEXT, path TEXT, is_dir INTEGER, size INTEGER, mtime REAL, subtitles INTEGER, subs_dir INTEGER, largest TEXT)"
+            )
+            db.execute("DELETE FROM entries")
+            db.executemany(
+                f"INSERT INTO entries VALUES ({', '.join('?' * len(FIELDS))})", rows
+            )
+        self.saved = version
+
+
+class DiskStats:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.usage = {}
+        self.lock = Lock()
+
+    def get(self, root):
+        with self.lock:
+            expires, usage = self.usage.get(root, (0, None))
+            if expires < now():
+                usage = list(disk_usage(root))
+                self.usage[root] = (now() + self.ttl, usage)
+            return list(usage)
+
+    def reclaim(self, root, size):
+        with self.lock:
+            if root in self.usage:
+                _, (total, used, free) = self.usage[root]
+                used, free = max(used - size, 0), min(free + size, total)
+                self.usage[root] = (now() + self.ttl, [total, used, free])
+
+    def invalidate(self, root=None):
+        with self.lock:
+            if root:
+                self.usage.pop(root, None)
+            else:
+                self.usage.clear()
+
+
+class Admission:
+    def __init__(self, disk_stats, roots, margin=2**30):
+        self.disk_stats = disk_stats
+        self.roots = [root for root in roots if root]
+        self.margin = margin
+        self.reservations = {}
+        self.lock = Lock()
+
+    def available(self, root):
+        if not path.isdir(root):
+            return 0
+        reserved = sum(size for r, size in self.reservations.values() if r == root)
+        return self.disk_stats.get(root)[2] - reserved - self.margin
+
+    def admit(self, info_hash, size):
+        with self.lock:
+            self.reservations.pop(info_hash, None)
+            for root in self.roots:
+                if self.available(root) >= size:
+                    self.reservations[info_hash] = (root, size)
+                    return root
+
+    def admitted(self, info_hash):
+        with self.lock:
+            return info_hash in self.reservations
+
+    def update(self, info_hash, remaining):
+        with self.lock:
+            if info_hash in self.reservations:
+                root, _ = self.reservations[info_hash]
+                self.reservations[info_hash] = (root, max(remaining, 0))
+
+    def root(self, folder):
+        folder = path.normpath(folder)
+        for root in self.roots:
+            if path.normpath(root) == folder:
+                return root
+        return folder
+
+    def reserve(self, info_hash, root, remaining):
+        with self.lock:
+            self.reservations[info_hash] = (self.root(root), max(remaining, 0))
+
+    def release(self, info_hash):
+        with self.lock:
+            self.reservations.pop(info_hash, None)
+
+    def free(self):
+        with self.lock:
+            return max([self.available(root) for root in self.roots] + [0])
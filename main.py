@@ -1,14 +1,33 @@
-from os import getenv, uname, path, listdir, remove
-from shutil import rmtree, disk_usage, copyfile, copytree
+from os import getenv, uname, path, listdir, remove, makedirs
+from shutil import rmtree, copyfile
 from subprocess import run, Popen
-from threading import Thread, Event
+from urllib.request import urlopen
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlparse
+from secrets import token_urlsafe
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+from threading import Thread, Event, Lock, Condition
+from heapq import heappush, heappop
+from bisect import bisect_left, bisect_right
+from itertools import count
+from hashlib import blake2b
+from base64 import urlsafe_b64encode
 from time import time as now, sleep
 from datetime import datetime as dt
 from logging import basicConfig, getLogger, INFO, DEBUG
 from rich.logging import RichHandler
 from telebot import TeleBot, types
+from telebot.apihelper import ApiTelegramException
 from qbittorrent import Client
-from plugins import TorrentSearch, SubtitlesSearchV2, get_public_ip
+from infohash import from_torrent, from_magnet, torrent_size
+from library import Library, DiskStats, Admission
+from transfer import Mover, Trash
+from journal import Journal
+from subtitles import SubtitlesFetcher, VIDEO
+from resilience import Guarded, CircuitOpen, breaker, backoff
+from webhook import WebhookServer
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,6 +44,29 @@ qb_pass = getenv("QB_PASS")
 ost_user = getenv("OST_USER")
 ost_pass = getenv("OST_PASS")
 ost_apikey = getenv("OST_API_KEY")
+async_mode = getenv("ASYNC_MODE", "").lower() in ["1", "true"]
+state_dir = getenv("STATE_DIR") or path.join(
+    path.dirname(path.abspath(__file__)), ".mediagram"
+)
+search_ttl = int(getenv("SEARCH_TTL", 6 * 60 * 60))
+search_negative_ttl = int(getenv("SEARCH_NEGATIVE_TTL", 15 * 60))
+torrent_providers = [
+    name.strip()
+    for name in getenv("TORRENT_PROVIDERS", "apibay").split(",")
+    if name.strip()
+]
+max_downloads = int(getenv("MAX_DOWNLOADS", 2))
+background_limit = int(getenv("BACKGROUND_LIMIT", 512)) * 1024
+stream_runtime = int(getenv("STREAM_RUNTIME", 40)) * 60
+dashboard_mode = getenv("DASHBOARD", "").lower() in ["1", "true"]
+dashboard_interval = int(getenv("DASHBOARD_INTERVAL", 5))
+bot_threads = int(getenv("BOT_THREADS", 4))
+webhook_port = int(getenv("WEBHOOK_PORT", 0))
+webhook_url = getenv("WEBHOOK_URL", "")
+webhook_secret = getenv("WEBHOOK_SECRET") or token_urlsafe(32)
+auto_subtitles = [
+    lang.strip() for lang in getenv("AUTO_SUBTITLES", "").split(",") if lang.strip()
+]
 
 # Platform
 repo = dir_test
@@ -32,10 +74,10 @@ repo_alt = None
 LOG_MODE = DEBUG
 is_rpi = uname().machine == "aarch64"
 if is_rpi:
-    run("/media/refresh.sh", shell=True)
     repo = dir_prod
     repo_alt = dir_prod_alt
     LOG_MODE = INFO
+makedirs(state_dir, exist_ok=True)
 started = False
 killed = False
 
@@ -49,35 +91,514 @@ basicConfig(
 logger = getLogger("rich")
 
 
-class SafeRequest:
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = now()
+        self.blocked_until = 0
+
+    def delay(self):
+        t = now()
+        self.tokens = min(self.capacity, self.tokens + (t - self.timestamp) * self.rate)
+        self.timestamp = t
+        wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - t)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.blocked_until = now() + seconds
+
+
+class Outgoing:
+    def __init__(self, chat_id, id=None, rate=0.5):
+        self.chat_id = chat_id
+        self.id = id
+        self.bucket = TokenBucket(rate)
+        self.sent = Event()
+        if id:
+            self.sent.set()
+        self.send = None
+        self.edit = None
+        self.delete = False
+        self.background = False
+
+    def wait(self, timeout=None):
+        self.sent.wait(timeout)
+        return self.id
+
+    def next_op(self):
+        if self.send:
+            return "send"
+        if self.delete:
+            return "delete"
+        if self.edit:
+            return "edit"
+
+
+class Sender:
+    def __init__(self, bot, chat_rate=1, chat_burst=3, message_rate=0.5):
+        self.bot = Guarded(
+            bot, breaker("Telegram", retries=1, ignore=ApiTelegramException)
+        )
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.message_rate = message_rate
+        self.chats = {}
+        self.messages = {}
+        self.pending = {}
+        self.cond = Condition()
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        self.stopped = False
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+
+    def target(self, chat_id, message):
+        if isinstance(message, Outgoing):
+            return message
+        key = (chat_id, message)
+        if key not in self.messages:
+            self.messages[key] = Outgoing(chat_id, message, self.message_rate)
+        return self.messages[key]
+
+    def enqueue(self, out, background=False):
+        if not out.next_op():
+            self.pending.pop(out, None)
+        elif out not in self.pending:
+            out.background = background
+            self.pending[out] = out
+        else:
+            out.background = out.background and background
+        self.cond.notify_all()
+
+    def send_message(self, chat_id, text, background=False, **kwargs):
+        with self.cond:
+            out = Outgoing(chat_id, rate=self.message_rate)
+            out.send = dict(text=text, **kwargs)
+            self.enqueue(out, background)
+            return out
+
+    def edit_message_text(self, text, chat_id, message, background=False, **kwargs):
+        with self.cond:
+            out = self.target(chat_id, message)
+            if out.delete:
+                return out
+            if out.send:
+                out.send = dict(out.send, text=text, **kwargs)
+            else:
+                out.edit = dict(text=text, **kwargs)
+            self.enqueue(out, background)
+            return out
+
+    def delete_message(self, chat_id, message):
+        with self.cond:
+            out = self.target(chat_id, message)
+            if out.send:
+                out.send = None
+                out.sent.set()
+            else:
+                out.delete = True
+            out.edit = None
+            self.enqueue(out)
+            return out
+
+    def bucket(self, chat_id):
+        if chat_id not in self.chats:
+            self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self.chats[chat_id]
+
+    def pick(self):
+        wait = None
+        for background in (False, True):
+            for out in self.pending:
+                if out.background != background:
+                    continue
+                delay = self.bucket(out.chat_id).delay()
+                if out.next_op() == "edit":
+                    delay = max(delay, out.bucket.delay())
+                if delay <= 0:
+                    return out, 0
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    out, wait = self.pick()
+                    if out or (self.stopped and not self.pending):
+                        break
+                    self.cond.wait(wait)
+                if not out:
+                    return
+                op = out.next_op()
+                self.bucket(out.chat_id).take()
+                if op == "edit":
+                    out.bucket.take()
+                    kwargs, out.edit = out.edit, None
+                elif op == "send":
+                    kwargs, out.send = out.send, None
+                else:
+                    kwargs, out.delete = {}, False
+                background = out.background
+                self.pending.pop(out, None)
+                self.enqueue(out, background)
+            if op == "send" or out.id:
+                self.execute(out, op, kwargs)
+
+    def execute(self, out, op, kwargs):
+        try:
+            if op == "send":
+                out.id = self.bot.send_message(out.chat_id, **kwargs).id
+                out.sent.set()
+            elif op == "edit":
+                self.bot.edit_message_text(
+                    chat_id=out.chat_id, message_id=out.id, **kwargs
+                )
+            else:
+                self.bot.delete_message(out.chat_id, out.id)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = e.result_json.get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Telegram - flood limit, retry in {retry_after}s")
+                with self.cond:
+                    self.bucket(out.chat_id).block(retry_after)
+                    if op == "send" and not out.send and not out.sent.is_set():
+                        out.send = kwargs
+                    elif op == "edit" and not out.edit and not out.delete:
+                        out.edit = kwargs
+                    elif op == "delete":
+                        out.delete = True
+                    self.enqueue(out, out.background)
+            elif "message is not modified" not in e.description:
+                logger.warning(f"Telegram - {op} failed: {e.description}")
+        except Exception as e:
+            logger.warning(f"Telegram - {op} failed: {e}")
+        with self.cond:
+            if op == "send" and not out.send:
+                out.sent.set()
+            if out.id and not out.next_op():
+                self.messages.pop((out.chat_id, out.id), None)
+
+
+class CallbackRegistry:
+    def __init__(self, ttl=24 * 60 * 60, size=6):
+        self.ttl = ttl
+        self.size = size
+        self.items = {}
+        self.keys = {}
+        self.lock = Lock()
+
+    def register(self, value):
+        with self.lock:
+            self.evict()
+            key = self.keys.get(value)
+            if not key:
+                digest = blake2b(value.encode(), digest_size=self.size * 2).digest()
+                key = urlsafe_b64encode(digest).decode()[: self.size]
+                while key in self.items:
+                    key = urlsafe_b64encode(blake2b(key.encode()).digest()).decode()
+                    key = key[: self.size]
+                self.keys[value] = key
+            self.items.pop(key, None)
+            self.items[key] = (now() + self.ttl, value)
+            return key
+
+    def resolve(self, key):
+        with self.lock:
+            self.evict()
+            item = self.items.get(key)
+            return item[1] if item else None
+
+    def evict(self):
+        while self.items:
+            key, (expires, value) = next(iter(self.items.items()))
+            if expires > now():
+                break
+            del self.items[key]
+            del self.keys[value]
+
+
+class Lazy:
+    def __init__(self, build):
+        self.build = build
+        self.target = None
+        self.lock = Lock()
+
+    def get(self):
+        with self.lock:
+            if self.target is None:
+                self.target = self.build()
+            return self.target
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+class Sessions:
+    def __init__(self, ttl=60 * 60):
+        self.ttl = ttl
+        self.items = {}
+        self.lock = Lock()
+
+    def open(self, chat_id, key, kind, *messages, **data):
+        with self.lock:
+            self.evict()
+            session = dict(data, kind=kind, messages=messages)
+            self.items.pop((chat_id, key), None)
+            self.items[(chat_id, key)] = (now() + self.ttl, session)
+            return session
+
+    def get(self, chat_id, key):
+        with self.lock:
+            self.evict()
+            item = self.items.get((chat_id, key))
+            return item[1] if item else None
+
+    def update(self, chat_id, key, **fields):
+        with self.lock:
+            self.evict()
+            item = self.items.pop((chat_id, key), None)
+            if not item:
+                return None
+            session = dict(item[1], **fields)
+            self.items[(chat_id, key)] = (now() + self.ttl, session)
+            return session
+
+    def close(self, chat_id, key):
+        with self.lock:
+            self.evict()
+            item = self.items.pop((chat_id, key), None)
+            return item[1] if item else None
+
+    def close_latest(self, chat_id, kind):
+        with self.lock:
+            self.evict()
+            for key, (_, session) in reversed(self.items.items()):
+                if key[0] == chat_id and session["kind"] == kind:
+                    del self.items[key]
+                    return session
+            return None
+
+    def evict(self):
+        while self.items:
+            key, (expires, _) = next(iter(self.items.items()))
+            if expires > now():
+                break
+            del self.items[key]
+
+
+class Scheduler:
     def __init__(self):
-        self.delay = 0.5
-        self.timestamp = 0
+        self.jobs = {}
+        self.queue = []
+        self.seq = count()
+        self.cond = Condition()
+        self.stopped = False
+        self.thread = None
 
-    def release(self):
-        self.timestamp = now()
-        return True
+    def start(self):
+        self.stopped = False
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+
+    def add(self, key, callback, interval=0, delay=0):
+        with self.cond:
+            self.jobs[key] = dict(
+                callback=callback, interval=interval, due=None, last=0
+            )
+            self.push(key, now() + delay)
+
+    def remove(self, key):
+        with self.cond:
+            self.jobs.pop(key, None)
+            self.cond.notify_all()
 
-    def is_releasable(self):
-        return self.timestamp + self.delay < now()
+    def schedule(self, key, delay=0):
+        with self.cond:
+            job = self.jobs.get(key)
+            if job:
+                self.push(key, max(now() + delay, job["last"] + job["interval"]))
+
+    def schedule_all(self, delay=0):
+        with self.cond:
+            for key in self.jobs:
+                self.push(key, now() + delay)
+
+    def push(self, key, due):
+        job = self.jobs[key]
+        if job["due"] is None or due < job["due"]:
+            job["due"] = due
+            heappush(self.queue, (due, next(self.seq), key))
+            self.cond.notify_all()
+
+    def wait_empty(self, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.jobs, timeout)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    if not self.queue:
+                        self.cond.wait()
+                        continue
+                    due, _, key = self.queue[0]
+                    if due > now():
+                        self.cond.wait(due - now())
+                        continue
+                    heappop(self.queue)
+                    job = self.jobs.get(key)
+                    if job and job["due"] == due:
+                        job["due"], job["last"] = None, now()
+                        break
+                if self.stopped:
+                    return
+            try:
+                delay = job["callback"]()
+            except Exception as e:
+                logger.error(f"Scheduler - '{key}' failed: {e}")
+                delay = job["interval"]
+            if delay is not None:
+                self.schedule(key, delay)
+
+
+class TorrentState:
+    def __init__(self, qb, interval=1):
+        self.qb = qb
+        self.interval = interval
+        self.torrents = {}
+        self.rid = 0
+        self.lock = Lock()
+        self.changed = Condition(self.lock)
+        self.poll_lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.listeners = []
+        self.versions = {}
+
+    def start(self):
+        self.poll()
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except CircuitOpen:
+                pass
+            except Exception as e:
+                logger.warning(f"qBittorrent - sync failed: {e}")
+
+    def poll(self):
+        with self.poll_lock:
+            changed = self.apply(self.qb.sync_main_data(rid=self.rid))
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+
+    def apply(self, data):
+        with self.lock:
+            if data.get("full_update"):
+                self.torrents = {}
+            for info_hash, fields in data.get("torrents", {}).items():
+                self.torrents.setdefault(info_hash, {"hash": info_hash}).update(fields)
+            for info_hash in data.get("torrents_removed", []):
+                self.torrents.pop(info_hash, None)
+            self.rid = data.get("rid", 0)
+            self.changed.notify_all()
+        changed = set(data.get("torrents", {})) | set(data.get("torrents_removed", []))
+        for info_hash in changed:
+            self.versions[info_hash] = self.versions.get(info_hash, 0) + 1
+        return changed
+
+    def get(self, info_hash=None, name=None):
+        with self.lock:
+            if info_hash:
+                torrent = self.torrents.get(info_hash)
+            elif name:
+                torrent = next(
+                    (t for t in self.torrents.values() if t.get("name") == name), None
+                )
+            else:
+                torrent = None
+            return dict(torrent) if torrent else None
+
+    def wait(self, info_hash, timeout=None):
+        with self.changed:
+            return self.changed.wait_for(lambda: info_hash in self.torrents, timeout)
+
+
+TOGGLES = ["toggle_sequential_download", "toggle_first_last_piece_priority"]
 
 
 class QBittorrent:
     qb = None
+    state = None
 
-    def start(self):
+    def start(self, deadline=30):
+        if self.ready():
+            return
         Popen("qbittorrent-nox", shell=True)
         logger.info("qBittorrent - starting...")
-        sleep(2)
+        self.wait_ready(deadline)
+
+    def ready(self):
+        try:
+            urlopen(f"{qb_addr.rstrip('/')}/api/v2/app/version", timeout=2)
+        except HTTPError:
+            pass
+        except (URLError, OSError):
+            return False
+        return True
+
+    def wait_ready(self, deadline=30):
+        expires, attempt = now() + deadline, 0
+        while not self.ready():
+            if now() > expires:
+                raise TimeoutError(f"qBittorrent not ready after {deadline}s")
+            sleep(min(0.1 * 2**attempt, 2))
+            attempt += 1
+        logger.info("qBittorrent - ready")
 
     def init(self):
-        self.qb = Client(qb_addr)
+        self.qb = Guarded(
+            Client(qb_addr, timeout=30), breaker("qBittorrent"), once=TOGGLES
+        )
         self.qb.login(qb_user, qb_pass)
         logger.info("qBittorrent - connected")
-        self.clean_torrents()
+        self.state = TorrentState(self.qb)
+        self.state.start()
 
     def close(self):
-        self.clean_torrents()
+        self.state.stop()
         # self.qb.logout()
         logger.info("qBittorrent - disconnected")
 
@@ -100,36 +621,62 @@ class QBittorrent:
         s = eta % 60
         return f"{h:02d}:{m:02d}:{s:02d}"
 
-    def download_from_torrent_file(self, torrent):
-        self.qb.download_from_file(torrent, save_path=repo)
+    def download_from_torrent_file(self, torrent, save_path=None):
+        info_hash = from_torrent(torrent)
+        self.qb.download_from_file(torrent, save_path=save_path or repo)
+        self.state.poll()
+        return info_hash
 
     def download_from_magnet_link(self, magnet):
+        info_hash = from_magnet(magnet)
         self.qb.download_from_link(magnet, save_path=repo)
+        self.state.poll()
+        return info_hash
 
     def only_sequential(self, info_hash):
         self.qb.toggle_sequential_download(info_hash)
         self.qb.toggle_first_last_piece_priority(info_hash)
 
-    def get_torrent(self, info_hash=None, name=None, new=False):
-        if info_hash:
-            for t in self.qb.torrents():
-                if t["hash"] == info_hash:
-                    return t
-        elif name:
-            for t in self.qb.torrents():
-                if t["name"] == name:
-                    return t
-        elif new:
-            return self.qb.torrents(sort="added_on")[-1]
-
-    def clean_torrents(self):
-        self.qb.delete_all_permanently()
+    def get_torrent(self, info_hash=None, name=None):
+        return self.state.get(info_hash=info_hash, name=name)
+
+    def clean_torrents(self, keep=()):
+        orphans = [h for h in self.state.torrents if h not in keep]
+        if orphans:
+            self.qb.delete_permanently("|".join(orphans))
 
     def delete_torrent(self, info_hash):
         self.qb.delete(info_hash)
 
-    def log_torrent(self, info_hash=None, name=None, new=False):
-        torrent = self.get_torrent(info_hash=info_hash, name=name, new=new)
+    def set_location(self, info_hash, location):
+        self.qb.set_torrent_location(info_hash, location)
+
+    def toggle_sequential(self, info_hash):
+        self.qb.toggle_sequential_download(info_hash)
+
+    def toggle_first_last(self, info_hash):
+        self.qb.toggle_first_last_piece_priority(info_hash)
+
+    def torrent_properties(self, info_hash):
+        return self.qb.get_torrent(info_hash)
+
+    def torrent_files(self, info_hash):
+        return self.qb.get_torrent_files(info_hash)
+
+    def piece_states(self, info_hash):
+        return self.qb.get_torrent_piece_states(info_hash)
+
+    def pause(self, info_hash):
+        self.qb.pause(info_hash)
+
+    def resume(self, info_hash):
+        self.qb.resume(info_hash)
+
+    def set_download_limit(self, info_hash, limit):
+        self.qb.set_torrent_download_limit(info_hash, limit)
+
+    def log_torrent(self, info_hash=None, name=None):
+        torrent = self.get_torrent(info_hash=info_hash, name=name)
         if torrent:
             status = f"🌊 {torrent['state'].capitalize()}"
             seeders = f"🔗 {torrent['num_seeds']} ({torrent['num_complete']})"
@@ -146,226 +693,1643 @@ class QBittorrent:
             )
 
 
+class DownloadQueue:
+    WATCH, NORMAL, BACKGROUND = 0, 1, 2
+    LABELS = {WATCH: "🎯 Watch next", NORMAL: "", BACKGROUND: "🐢 Background"}
+    PAUSED = ("paused", "stopped")
+
+    def __init__(self, qb, max_active=2, background_limit=512 * 1024):
+        self.qb = qb
+        self.max_active = max_active
+        self.background_limit = background_limit
+        self.priorities = {}
+        self.order = count()
+        self.lock = Lock()
+        self.rebalance_lock = Lock()
+
+    def add(self, info_hash, priority=NORMAL):
+        with self.lock:
+            if info_hash not in self.priorities:
+                self.priorities[info_hash] = (priority, next(self.order))
+        self.rebalance()
+
+    def remove(self, info_hash):
+        with self.lock:
+            self.priorities.pop(info_hash, None)
+        self.rebalance()
+
+    def set_priority(self, info_hash, priority):
+        with self.lock:
+            if info_hash not in self.priorities:
+                return False
+            order = next(self.order)
+            self.priorities[info_hash] = (
+                priority,
+                -order if priority == self.WATCH else order,
+            )
+        self.rebalance()
+        return True
+
+    def priority(self, info_hash):
+        with self.lock:
+            return self.priorities.get(info_hash, (self.NORMAL, 0))[0]
+
+    def label(self, info_hash):
+        return self.LABELS[self.priority(info_hash)]
+
+    def rebalance(self):
+        with self.rebalance_lock:
+            with self.lock:
+                ranked = sorted(self.priorities, key=self.priorities.get)
+            changed = False
+            for i, info_hash in enumerate(ranked):
+                torrent = self.qb.get_torrent(info_hash)
+                if not torrent:
+                    continue
+                paused = torrent.get("state", "").startswith(self.PAUSED)
+                if i >= self.max_active:
+                    if not paused:
+                        self.qb.pause(info_hash)
+                        changed = True
+                    continue
+                if paused:
+                    self.qb.resume(info_hash)
+                    changed = True
+                limit = 0 if i == 0 else self.background_limit
+                if max(torrent.get("dl_limit", 0), 0) != limit:
+                    self.qb.set_download_limit(info_hash, limit)
+                    changed = True
+                if torrent.get("seq_dl", False) != (i == 0):
+                    self.qb.toggle_sequential(info_hash)
+                    changed = True
+                if torrent.get("f_l_piece_prio", False) != (i == 0):
+                    self.qb.toggle_first_last(info_hash)
+                    changed = True
+            if changed:
+                self.qb.state.poll()
+
+
+class StreamTracker:
+    DOWNLOADED = 2
+
+    def __init__(
+        self, qb, runtime=40 * 60, margin=1.2, min_buffer=32 * 2**20, interval=10
+    ):
+        self.qb = qb
+        self.runtime = runtime
+        self.margin = margin
+        self.min_buffer = min_buffer
+        self.interval = interval
+        self.entries = {}
+
+    def check(self, info_hash):
+        torrent = self.qb.get_torrent(info_hash)
+        if (
+            not torrent
+            or torrent.get("total_size", 0) <= 0
+            or not torrent.get("seq_dl")
+        ):
+            return None
+        entry = self.entries.get(info_hash) or self.track(info_hash)
+        if (
+            entry["done"]
+            or torrent.get("completed") == entry["completed"]
+            or now() - entry["checked"] < self.interval
+        ):
+            return None
+        entry.update(completed=torrent.get("completed"), checked=now())
+        states = self.qb.piece_states(info_hash)
+        prefix, last = entry["prefix"], entry["last"]
+        while prefix <= last and states[prefix] == self.DOWNLOADED:
+            prefix += 1
+        entry["prefix"] = prefix
+        buffered = min((prefix - entry["first"]) * entry["piece_size"], entry["size"])
+        remaining, speed = entry["size"] - buffered, torrent.get("dlspeed", 0)
+        if states[last] != self.DOWNLOADED or (remaining and not speed):
+            return None
+        if buffered < min(self.min_buffer, entry["size"]):
+            return None
+        if remaining / max(speed, 1) * self.margin > self.runtime:
+            return None
+        entry["done"] = True
+        return entry["name"]
+
+    def track(self, info_hash):
+        videos = [
+            f
+            for f in self.qb.torrent_files(info_hash)
+            if f["name"].lower().endswith(VIDEO)
+        ]
+        entry = dict(done=not videos, completed=None, checked=0)
+        if videos:
+            video = max(videos, key=lambda f: f["size"])
+            first, last = video["piece_range"]
+            entry.update(
+                name=video["name"],
+                size=video["size"],
+                first=first,
+                last=last,
+                prefix=first,
+                piece_size=self.qb.torrent_properties(info_hash)["piece_size"],
+            )
+        self.entries[info_hash] = entry
+        return entry
+
+    def forget(self, info_hash):
+        self.entries.pop(info_hash, None)
+
+
+class Dashboard:
+    def __init__(self, sender, chat_id, render, state=None):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.render = render
+        self.state = state
+        self.entries = {}
+        self.message = None
+        self.shown = None
+        self.lock = Lock()
+
+    def start(self):
+        if not self.state or not path.exists(self.state):
+            return
+        try:
+            with open(self.state) as f:
+                stale = json.load(f).get("message_id")
+        except (OSError, ValueError):
+            stale = None
+        if stale:
+            self.sender.delete_message(self.chat_id, stale)
+            logger.info(f"Dashboard - stale message removed: {stale}")
+        remove(self.state)
+
+    def add(self, key, name):
+        with self.lock:
+            self.entries[key] = name
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def refresh(self):
+        with self.lock:
+            entries = dict(self.entries)
+        text, markup, signature = self.render(entries)
+        if signature == self.shown:
+            return
+        self.shown = signature
+        if self.message is None:
+            self.message = self.sender.send_message(
+                self.chat_id, text, reply_markup=markup
+            )
+            message_id = self.message.wait(10)
+            if message_id and self.state:
+                with open(self.state, "w") as f:
+                    json.dump(dict(message_id=message_id), f)
+            try:
+                self.sender.bot.pin_chat_message(
+                    self.chat_id, message_id, disable_notification=True
+                )
+            except Exception as e:
+                logger.warning(f"Telegram - pin failed: {e}")
+        else:
+            self.sender.edit_message_text(
+                text, self.chat_id, self.message, background=True, reply_markup=markup
+            )
+
+
+class AsyncTorrentState(TorrentState):
+    def __init__(self, qb, interval=1):
+        super().__init__(qb, interval)
+        self.poll_lock = asyncio.Lock()
+        self.waiters = {}
+        self.task = None
+
+    async def start(self):
+        await self.poll()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except CircuitOpen:
+                pass
+            except Exception as e:
+                logger.warning(f"qBittorrent - sync failed: {e}")
+
+    async def poll(self):
+        async with self.poll_lock:
+            changed = self.apply(await self.qb.sync_main_data(rid=self.rid))
+        for info_hash in changed:
+            for waiter in self.waiters.pop(info_hash, []):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def wait_change(self, info_hash, version):
+        if self.versions.get(info_hash, 0) == version:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.setdefault(info_hash, []).append(waiter)
+            await waiter
+        return self.versions.get(info_hash, 0)
+
+
+class AsyncQBittorrent(QBittorrent):
+    async def start(self, deadline=30):
+        if await asyncio.to_thread(self.ready):
+            return
+        await asyncio.create_subprocess_shell("qbittorrent-nox")
+        logger.info("qBittorrent - starting...")
+        await asyncio.to_thread(self.wait_ready, deadline)
+
+    async def init(self):
+        from qbittorrent_async import AsyncClient
+
+        self.client = AsyncClient(qb_addr)
+        self.qb = Guarded(self.client, breaker("qBittorrent"), once=TOGGLES)
+        await self.qb.login(qb_user, qb_pass)
+        logger.info("qBittorrent - connected")
+        await self.clean_torrents()
+        self.state = AsyncTorrentState(self.qb)
+        await self.state.start()
+
+    async def close(self):
+        await self.state.stop()
+        await self.clean_torrents()
+        logger.info("qBittorrent - disconnected")
+
+    async def stop(self):
+        await self.qb.shutdown()
+        logger.info("qBittorrent - stopping...")
+
+    async def download_from_torrent_file(self, torrent, save_path=None):
+        info_hash = from_torrent(torrent)
+        await self.qb.download_from_file(torrent, save_path=save_path or repo)
+        await self.state.poll()
+        return info_hash
+
+    async def download_from_magnet_link(self, magnet):
+        info_hash = from_magnet(magnet)
+        await self.qb.download_from_link(magnet, save_path=repo)
+        await self.state.poll()
+        return info_hash
+
+    async def only_sequential(self, info_hash):
+        await self.qb.toggle_sequential_download(info_hash)
+        await self.qb.toggle_first_last_piece_priority(info_hash)
+
+    async def clean_torrents(self):
+        await self.qb.delete_all_permanently()
+
+    async def delete_torrent(self, info_hash):
+        await self.qb.delete(info_hash)
+
+    async def set_location(self, info_hash, location):
+        await self.qb.set_location(info_hash, location)
+
+
+def startup(steps):
+    timings, begin = {}, now()
+
+    def timed(name, step):
+        start = now()
+        step()
+        timings[name] = now() - start
+
+    with ThreadPoolExecutor(len(steps)) as pool:
+        futures = [pool.submit(timed, name, step) for name, step in steps.items()]
+        for future in futures:
+            future.result()
+    timings["total"] = now() - begin
+    logger.info(
+        "Mediagram - startup: "
+        + ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in timings.items())
+    )
+
+
+async def startup_async(steps):
+    timings, begin = {}, now()
+
+    async def timed(name, step):
+        start = now()
+        await step
+        timings[name] = now() - start
+
+    results = await asyncio.gather(
+        *(timed(name, step) for name, step in steps.items()), return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    timings["total"] = now() - begin
+    logger.info(
+        "Mediagram - startup: "
+        + ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in timings.items())
+    )
+
+
+COMMANDS = [
+    types.BotCommand("download", "🎬 Download"),
+    types.BotCommand("subtitles", "💬 Add subtitles"),
+    types.BotCommand("list", "🔍 List files"),
+    types.BotCommand("move", "🚚 Move file(s)"),
+    types.BotCommand("delete", "❌ Delete file(s)"),
+    types.BotCommand("help", "📝 Description"),
+    types.BotCommand("alive", "⚪ Health check"),
+    types.BotCommand("force", "♻️ Force media refresh"),
+    types.BotCommand("alt", "💽 Mount alt disk"),
+    types.BotCommand("stop", "🔴 Kill the bot"),
+    types.BotCommand("restart", "🔵 Restart the bot"),
+]
+
+
+def delete_file(name, trash=None, **meta):
+    file, root = path.join(repo, name), repo
+    if not path.exists(file) and repo_alt:
+        file, root = path.join(repo_alt, name), repo_alt
+    srt = file[:-3] + "srt"
+    if path.isfile(file):
+        if trash:
+            trash.delete(file, root, **meta)
+            if path.isfile(srt):
+                trash.delete(srt, root)
+            return True
+        remove(file)
+        if path.isfile(srt):
+            remove(srt)
+        return True
+    elif path.isdir(file):
+        if trash:
+            trash.delete(file, root, **meta)
+            return True
+        rmtree(file, ignore_errors=True)
+        return True
+    return False
+
+
 def mediagram():
     qb = QBittorrent()
-    if is_rpi:
-        qb.start()
-    qb.init()
-
-    bot = TeleBot(token)
+    bot = TeleBot(token, threaded=not webhook_port, num_threads=bot_threads)
+    webhook = None
+    if webhook_port:
+        webhook = WebhookServer(
+            bot,
+            webhook_secret,
+            port=webhook_port,
+            path=urlparse(webhook_url).path or "/",
+            workers=bot_threads,
+        )
+    library = Library(
+        [("main", repo), ("alt", repo_alt)], snapshot=path.join(state_dir, "library.db")
+    )
     global started
+
+    def start_qbittorrent():
+        if is_rpi:
+            qb.start()
+        qb.init()
+
+    def start_webhook():
+        if not webhook:
+            bot.remove_webhook()
+        elif webhook_url:
+            bot.set_webhook(
+                webhook_url, secret_token=webhook_secret, drop_pending_updates=True
+            )
+        else:
+            logger.warning("Webhook - no WEBHOOK_URL, not registered to Telegram")
+
+    steps = dict(
+        qBittorrent=start_qbittorrent, library=library.start, webhook=start_webhook
+    )
     if not started:
-        bot.set_my_commands(
-            commands=[
-                types.BotCommand("download", "🎬 Download"),
-                types.BotCommand("subtitles", "💬 Add subtitles"),
-                types.BotCommand("list", "🔍 List files"),
-                types.BotCommand("move", "🚚 Move file(s)"),
-                types.BotCommand("delete", "❌ Delete file(s)"),
-                types.BotCommand("help", "📝 Description"),
-                types.BotCommand("alive", "⚪ Health check"),
-                types.BotCommand("force", "♻️ Force media refresh"),
-                types.BotCommand("alt", "💽 Mount alt disk"),
-                types.BotCommand("stop", "🔴 Kill the bot"),
-                types.BotCommand("restart", "🔵 Restart the bot"),
+        steps["commands"] = lambda: bot.set_my_commands(commands=COMMANDS)
+        if is_rpi:
+            steps["media"] = lambda: run("/media/refresh.sh", shell=True)
+    try:
+        startup(steps)
+    except Exception:
+        library.stop()
+        if qb.state:
+            qb.close()
+        raise
+
+    sender = Sender(bot)
+    signal = Event()
+    signal.set()
+    scheduler = mover = trash = subtitles_fetcher = subtitles_searcher = None
+    teardown_lock = Lock()
+
+    def teardown(farewell=None):
+        if not teardown_lock.acquire(blocking=False):
+            return
+        signal.clear()
+        if scheduler:
+            scheduler.schedule_all()
+            scheduler.wait_empty()
+            scheduler.stop()
+        for worker in [mover, trash, subtitles_fetcher]:
+            if worker:
+                worker.stop()
+        if subtitles_searcher and subtitles_searcher.target:
+            subtitles_searcher.stop()
+        library.stop()
+        qb.close()
+        if is_rpi:
+            try:
+                qb.stop()
+            except Exception as e:
+                logger.warning(f"qBittorrent - shutdown failed: {e}")
+        if farewell:
+            sender.send_message(chat_id, farewell)
+        sender.stop()
+        if webhook:
+            webhook.stop()
+        else:
+            bot.stop_polling()
+        logger.info("Mediagram - shutdown")
+
+    try:
+        sender.start()
+
+        def build_search_cache():
+            from plugins import SearchCache
+
+            return SearchCache(
+                path.join(state_dir, "search.db"),
+                ttl=search_ttl,
+                negative_ttl=search_negative_ttl,
+            )
+
+        search_cache = Lazy(build_search_cache)
+        callbacks = CallbackRegistry()
+        disk_stats = DiskStats()
+        admission = Admission(disk_stats, [repo, repo_alt])
+        downloads = DownloadQueue(qb, max_downloads, background_limit)
+        streams = StreamTracker(qb, stream_runtime)
+
+        def render_dashboard(entries):
+            lines, signature = [], []
+            markup = types.InlineKeyboardMarkup()
+            for i, (info_hash, name) in enumerate(entries.items(), 1):
+                torrent = qb.get_torrent(info_hash) or {}
+                state, eta = torrent.get("state", ""), torrent.get("eta", 0)
+                progress = torrent.get("progress", 0) * 100
+                label = downloads.label(info_hash)
+                bucket = eta // 60 if eta < 60 * 60 else eta // (15 * 60)
+                signature.append((info_hash, state, int(progress // 5), bucket, label))
+                lines.append(
+                    f"{i}. {name[:40]}\n🌊 {state.capitalize()} ⏳ {progress:.0f} % ⏱️ {qb.eta_format(eta)} {label}"
+                )
+                key = callbacks.register(info_hash)
+                markup.row(
+                    types.InlineKeyboardButton(f"{i} ⏫", callback_data=f"⏫{key}"),
+                    types.InlineKeyboardButton(f"{i} ⏬", callback_data=f"⏬{key}"),
+                )
+            text = "\n\n".join(lines) if lines else "💤 Idle"
+            return f"📊 Downloads\n\n{text}", markup, tuple(signature)
+
+        dashboard = (
+            Dashboard(
+                sender,
+                chat_id,
+                render_dashboard,
+                path.join(state_dir, "dashboard.json"),
+            )
+            if dashboard_mode
+            else None
+        )
+        ost_cache = path.join(state_dir, "opensubtitles.json")
+
+        def build_subtitles_searcher():
+            from plugins import SubtitlesSearchV2
+
+            searcher = SubtitlesSearchV2(
+                ost_user,
+                ost_pass,
+                ost_apikey,
+                token_cache=ost_cache,
+                search_cache=search_cache.get(),
+            )
+            searcher.api.on_download = subtitles_queued_done
+            return searcher
+
+        def build_torrent_searcher():
+            from plugins import TorrentSearch
+
+            return TorrentSearch(
+                search_cache.get(), torrent_providers, concurrency=bot_threads
+            )
+
+        subtitles_searcher = Lazy(build_subtitles_searcher)
+        torrent_searcher = Lazy(build_torrent_searcher)
+        views, views_lock = {}, Lock()
+        headers = {
+            "💿": "💾 Available files 💾\n{stats}",
+            "❌": "❌ Available files to delete ❌\n{stats}",
+            "🚚": "🚚 Available files to move 🚚\n{stats}",
+            "💬": "🪄 Add subtitles for:",
+        }
+        started = dt.fromtimestamp(now()).strftime("%Y-%m-%d  -  %H:%M:%S")
+        scheduler = Scheduler()
+        scheduler.start()
+        qb.state.listeners.append(
+            lambda changed: [scheduler.schedule(info_hash) for info_hash in changed]
+        )
+        if dashboard:
+            dashboard.start()
+
+            def refresh_dashboard():
+                dashboard.refresh()
+                if not signal.is_set():
+                    scheduler.remove("dashboard")
+
+            scheduler.add("dashboard", refresh_dashboard, interval=dashboard_interval)
+            qb.state.listeners.append(lambda changed: scheduler.schedule("dashboard"))
+        sessions = Sessions()
+
+        def open_session(kind, msg, *messages, **data):
+            key = msg.wait(10)
+            if key:
+                sessions.open(chat_id, key, kind, *messages, msg, **data)
+
+        def expired(call):
+            sender.edit_message_text(
+                "⌛ Expired, please retry.", chat_id, call.message.id
+            )
+            logger.info(f"/expired_session: {call.data}")
+
+        sender.send_message(chat_id, "🟢 Started.")
+        logger.info("Mediagram - initialized")
+
+        @bot.message_handler(commands=["start", "alive"])
+        def alive(message):
+            if message.chat.id == chat_id:
+                sender.send_message(
+                    chat_id, f"⏰ Started at:\n{started}\n🟢 Running..."
+                )
+                logger.info(message.text)
+
+        @bot.message_handler(commands=["force"])
+        def force(message):
+            if message.chat.id == chat_id:
+                run("/media/refresh.sh", shell=True)
+                sender.send_message(chat_id, "♻️ Force media refresh: Done.")
+                logger.info("/force: media-refresh")
+
+        @bot.message_handler(commands=["alt"])
+        def alt(message):
+            if message.chat.id == chat_id:
+                run("/media/mount.sh", shell=True)
+                sender.send_message(chat_id, "💽 Alt disk mounted: Done.")
+                logger.info("/alt: mounted")
+
+        @bot.message_handler(commands=["ip"])
+        def get_ip(message):
+            if message.chat.id == chat_id:
+                from plugins import get_public_ip
+
+                ip = get_public_ip()
+                if not ip:
+                    ip = "Error when checking IP."
+                sender.send_message(chat_id, ip)
+                logger.info(f"/ip: {ip}")
+
+        @bot.message_handler(commands=["stop", "restart"])
+        def kill(message):
+            if message.chat.id == chat_id:
+                if message.text == "/stop":
+                    global killed
+                    killed = True
+                    sender.send_message(chat_id, "🟠 Stopping...")
+                else:
+                    sender.send_message(chat_id, "🔵 Restarting...")
+                logger.info(message.text)
+                teardown("🔴 Shutdown.")
+
+        @bot.message_handler(commands=["help"])
+        def help(message):
+            if message.chat.id == chat_id:
+                sender.send_message(
+                    chat_id,
+                    "📝 Send a .torrent file or a magnet link to download it on your Raspberry Pi.",
+                )
+                logger.info(message.text)
+
+        @bot.callback_query_handler(func=lambda call: call.data == "Cancel")
+        def cancel(call):
+            if call.message.chat.id == chat_id:
+                session = sessions.close(chat_id, call.message.id)
+                messages = session["messages"] if session else [call.message.id]
+                for id in messages:
+                    sender.delete_message(chat_id, id)
+                logger.info("/cancel")
+
+        def move_progress(job, done, total):
+            name = job["meta"]["name"]
+            progress = f"{done / total * 100:.2f} %"
+            size = f"{qb.size_format(done)} / {qb.size_format(total)}"
+            sender.edit_message_text(
+                f"🚚 {name.capitalize()}\n⏳ {progress} ({size})",
+                chat_id,
+                job["meta"]["message_id"],
+                background=True,
+            )
+
+        def move_done(job, error):
+            name = job["meta"]["name"]
+            library.update("main", name)
+            library.update("alt", name)
+            disk_stats.invalidate()
+            if error:
+                sender.edit_message_text(
+                    f"🚚 {name.capitalize()}\n🗑 Not moved.",
+                    chat_id,
+                    job["meta"]["message_id"],
+                )
+                logger.info(f"/not-moved: '{name}'")
+            else:
+                sender.edit_message_text(
+                    f"🚚 {name.capitalize()}\n🗑 Moved.",
+                    chat_id,
+                    job["meta"]["message_id"],
+                )
+                logger.info(f"/moved: '{name}'")
+
+        def trash_done(root, size, meta):
+            disk_stats.reclaim(root, size)
+            if meta:
+                name = meta["name"]
+                sender.edit_message_text(
+                    f"❌ {name.capitalize()}\n🗑 Deleted.\n♻️ {qb.size_format(size)} reclaimed.",
+                    chat_id,
+                    meta["message_id"],
+                )
+                logger.info(f"/reclaimed: '{name}' ({size} bytes)")
+
+        trash = Trash([repo, repo_alt], on_done=trash_done)
+        trash.start()
+        mover = Mover(
+            path.join(state_dir, "transfers.json"),
+            on_progress=move_progress,
+            on_done=move_done,
+        )
+        mover.start()
+
+        def subtitles_done(results, name):
+            added = sum(1 for _, _, ok in results if ok)
+            queued = sum(1 for _, _, ok in results if ok is None)
+            text = f"💬 {name}\n✅ Subtitles added: {added}/{len(results)}"
+            if queued:
+                text += f"\n⏳ Queued until quota reset: {queued}"
+            sender.send_message(chat_id, text)
+            logger.info(f"/auto_subtitles: '{name}' ({added}/{len(results)})")
+
+        def subtitles_queued_done(id, file):
+            sender.send_message(
+                chat_id, f"✅ Queued subtitles added: {path.basename(file)}"
+            )
+            logger.info(f"/subtitles_added: '{file}'")
+
+        try:
+            with open(ost_cache) as f:
+                queued_subtitles = json.load(f).get("queued")
+        except (OSError, ValueError):
+            queued_subtitles = None
+
+        def resume_subtitles():
+            try:
+                subtitles_searcher.get()
+            except Exception as e:
+                logger.warning(f"Subtitles - queued downloads not resumed: {e}")
+
+        if queued_subtitles:
+            Thread(target=resume_subtitles, daemon=True).start()
+
+        subtitles_fetcher = SubtitlesFetcher(
+            subtitles_searcher,
+            auto_subtitles,
+            hasher=library.moviehash,
+            on_done=subtitles_done,
+        )
+        if auto_subtitles:
+            subtitles_fetcher.start()
+
+        claims, claims_lock = set(), Lock()
+
+        def unclaim(info_hash):
+            with claims_lock:
+                claims.discard(info_hash)
+
+        def download_manager(torrent_type, info_hash, record=None):
+            with claims_lock:
+                if info_hash in claims:
+                    logger.info(f"/already_downloading: '{info_hash}'")
+                    return
+                claims.add(info_hash)
+            watching = False
+            try:
+                watching = watch_download(torrent_type, info_hash, record)
+            finally:
+                if not watching:
+                    unclaim(info_hash)
+
+        def watch_download(torrent_type, info_hash, record):
+            if not qb.state.wait(info_hash, timeout=10):
+                logger.error(f"Torrent not found: '{info_hash}'")
+                admission.release(info_hash)
+                return False
+            info = qb.log_torrent(info_hash=info_hash)
+            file, name = info["name"], info["name"].capitalize()
+            downloads.add(info_hash)
+            logger.info(f"/download: '{file}'")
+            base = f"🌐 {name}\n🔥 {torrent_type} processed\n"
+            key = callbacks.register(info_hash)
+            markup = types.InlineKeyboardMarkup()
+            markup.row(
+                types.InlineKeyboardButton("⏫ Watch next", callback_data=f"⏫{key}"),
+                types.InlineKeyboardButton("⏬ Background", callback_data=f"⏬{key}"),
+            )
+            label = downloads.label(info_hash)
+            torrent = qb.get_torrent(info_hash)
+            root = admission.root(torrent.get("save_path", repo))
+            if dashboard:
+                msg = None
+                dashboard.add(info_hash, name)
+                scheduler.schedule("dashboard")
+            elif record and record.get("message_id"):
+                msg = record["message_id"]
+            else:
+                msg = sender.send_message(
+                    chat_id, f"{base}{info['details']}\n{label}", reply_markup=markup
+                )
+            if record is None:
+                message_id = msg.wait(10) if msg else None
+                journal.add(
+                    info_hash, type=torrent_type, message_id=message_id, root=root
+                )
+            elif torrent.get("total_size", 0) > 0:
+                admission.reserve(info_hash, root, torrent.get("amount_left", 0))
+
+            def notify(text):
+                if msg:
+                    sender.edit_message_text(text, chat_id, msg)
+                else:
+                    sender.send_message(chat_id, text)
+
+            def release():
+                scheduler.remove(info_hash)
+                unclaim(info_hash)
+                journal.remove(info_hash)
+                admission.release(info_hash)
+                downloads.remove(info_hash)
+                streams.forget(info_hash)
+                if dashboard:
+                    dashboard.remove(info_hash)
+                    scheduler.schedule("dashboard")
+
+            def update():
+                nonlocal info, label, root
+                if signal.is_set() and not info["done"]:
+                    new_info = qb.log_torrent(info_hash=info_hash)
+                    if not new_info:
+                        release()
+                        delete_file(file, trash)
+                        notify(f"{base}🚫 Aborted.")
+                        logger.info(f"/aborted: '{file}'")
+                        return
+                    torrent = qb.get_torrent(info_hash)
+                    if admission.admitted(info_hash):
+                        admission.update(info_hash, torrent.get("amount_left", 0))
+                    elif torrent.get("total_size", 0) > 0:
+                        root = admission.admit(info_hash, torrent["total_size"])
+                        if not root:
+                            release()
+                            qb.delete_torrent(info_hash)
+                            delete_file(file, trash)
+                            size = qb.size_format(torrent["total_size"])
+                            free = qb.size_format(admission.free())
+                            notify(
+                                f"{base}🚫 Not enough space: {size} needed, {free} free."
+                            )
+                            logger.info(
+                                f"/refused: '{file}' ({size} needed, {free} free)"
+                            )
+                            return
+                        current = path.normpath(torrent.get("save_path", repo))
+                        if current != path.normpath(root):
+                            qb.set_location(info_hash, root)
+                            journal.update(info_hash, root=root)
+                            logger.info(f"/routed: '{file}' to '{root}'")
+                    new_label = downloads.label(info_hash)
+                    if msg and (info != new_info or label != new_label):
+                        sender.edit_message_text(
+                            f"{base}{new_info['details']}\n{new_label}",
+                            chat_id,
+                            msg,
+                            background=True,
+                            reply_markup=markup,
+                        )
+                    info, label = new_info, new_label
+                    if not info["done"]:
+                        video = streams.check(info_hash)
+                        if video:
+                            sender.send_message(
+                                chat_id, f"🌐 {name}\n🍿 Ready to stream: {video}"
+                            )
+                            logger.info(f"/ready_to_stream: '{video}'")
+                        return
+                if not info["done"]:
+                    scheduler.remove(info_hash)
+                    unclaim(info_hash)
+                    logger.info(f"/detached: '{file}'")
+                    return
+                release()
+                qb.delete_torrent(info_hash)
+                if msg:
+                    sender.delete_message(chat_id, msg)
+                sender.send_message(chat_id, f"{base}✅ Completed. Ready to play!")
+                logger.info(f"/done: '{file}'")
+                subtitles_fetcher.fetch(path.join(root, file), name=name)
+
+            scheduler.add(info_hash, update, interval=2, delay=2)
+            return True
+
+        @bot.callback_query_handler(
+            func=lambda call: call.data.startswith(("⏫", "⏬"))
+        )
+        def callback_priority(call):
+            if call.message.chat.id == chat_id:
+                info_hash = callbacks.resolve(call.data[1:])
+                if call.data.startswith("⏫"):
+                    priority = DownloadQueue.WATCH
+                else:
+                    priority = DownloadQueue.BACKGROUND
+                if info_hash and downloads.set_priority(info_hash, priority):
+                    logger.info(
+                        f"/priority: '{info_hash}' {downloads.label(info_hash)}"
+                    )
+                    scheduler.schedule(info_hash, 0)
+                    scheduler.schedule("dashboard")
+
+        @bot.message_handler(
+            func=lambda message: message.document.mime_type
+            == "application/x-bittorrent",
+            content_types=["document"],
+        )
+        def upload_torrent_file(message):
+            if message.chat.id == chat_id:
+                file_info = bot.get_file(message.document.file_id)
+                torrent = bot.download_file(file_info.file_path)
+                if not path.exists(repo):
+                    logger.error(f"Missing directory: '{repo}'")
+                elif not signal.is_set():
+                    logger.info("/download-blocked - Torrent file")
+                else:
+                    logger.info(f"/upload_torrent_file: '{message.document.file_name}'")
+                    try:
+                        info_hash, size = from_torrent(torrent), torrent_size(torrent)
+                    except ValueError as e:
+                        logger.error(f"Invalid torrent file: {e}")
+                        return
+                    root = admission.admit(info_hash, size)
+                    if not root:
+                        size, free = qb.size_format(size), qb.size_format(
+                            admission.free()
+                        )
+                        sender.send_message(
+                            chat_id, f"🚫 Not enough space: {size} needed, {free} free."
+                        )
+                        logger.info(f"/refused: '{message.document.file_name}'")
+                        return
+                    try:
+                        qb.download_from_torrent_file(torrent, save_path=root)
+                    except Exception:
+                        admission.release(info_hash)
+                        raise
+                    sender.delete_message(chat_id, message.id)
+                    download_manager("Torrent file", info_hash)
+
+        @bot.message_handler(
+            func=lambda message: message.text.startswith("magnet:?xt="),
+            content_types=["text"],
+        )
+        def upload_magnet_link(message):
+            if message.chat.id == chat_id:
+                if not path.exists(repo):
+                    logger.error(f"Missing directory: '{repo}'")
+                elif not signal.is_set():
+                    logger.info("/download-blocked - Magnet link")
+                else:
+                    logger.info(f"/upload_magnet_link: '{message.text}'")
+                    try:
+                        info_hash = qb.download_from_magnet_link(message.text)
+                    except ValueError as e:
+                        logger.error(e)
+                        return
+                    sender.delete_message(chat_id, message.id)
+                    download_manager("Magnet link", info_hash)
+
+        @bot.callback_query_handler(
+            func=lambda call: call.data in ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣"]
+        )
+        def callback_select(call):
+            if call.message.chat.id == chat_id:
+                logger.info(f"/selected: {call.data}")
+                if not signal.is_set():
+                    logger.info("/download-blocked - Magnet link")
+                    return
+                session = sessions.close(chat_id, call.message.id)
+                if not session:
+                    expired(call)
+                    return
+                magnet = session["magnets"][call.data]
+                logger.info(f"/retrieved_magnet_link: '{magnet}'")
+                info_hash = qb.download_from_magnet_link(magnet)
+                for id in session["messages"][1:]:
+                    sender.delete_message(chat_id, id)
+                download_manager("Magnet link", info_hash)
+
+        @bot.message_handler(
+            func=lambda m: not list(
+                filter(
+                    lambda x: m.text.startswith(x),
+                    ["/", "magnet:?xt=", "🌐", "💬", "🔈", "❌", "🚚"],
+                )
+            ),
+            content_types=["text"],
+        )
+        def torrent_select(message):
+            if message.chat.id == chat_id:
+                logger.info(f"/request: '{message.text}'")
+                prompt = sessions.close_latest(chat_id, "download")
+                messages = (*(prompt["messages"] if prompt else ()), message.id)
+                torrents = torrent_searcher.query(message.text)
+                if not torrents:
+                    sender.send_message(chat_id, f"🚫 No result for: {message.text}")
+                    for id in messages[1:]:
+                        sender.delete_message(chat_id, id)
+                    logger.info("/no_result")
+                else:
+                    text = f"⛳️ Results for: {message.text}\n"
+                    markup = types.InlineKeyboardMarkup()
+                    row, magnets = [], {}
+                    for i, t in zip(["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣"], torrents):
+                        text += f"\n{i} {t['name']}\n💾 {t['size']} Go 🔗 {t['seeders']} 👤 {t['leechers']}\n⏰ {t['date']}\n"
+                        row.append(types.InlineKeyboardButton(i, callback_data=i))
+                        magnets[i] = t["magnet"]
+                    markup.row(*row)
+                    markup.add(
+                        types.InlineKeyboardButton("Cancel", callback_data="Cancel")
+                    )
+                    msg = sender.send_message(chat_id, text, reply_markup=markup)
+                    open_session("results", msg, *messages, magnets=magnets)
+                    logger.info("/torrent_select")
+
+        @bot.message_handler(commands=["download"])
+        def downloader(message):
+            if message.chat.id == chat_id:
+                if not path.exists(repo):
+                    logger.error(f"Missing directory: '{repo}'")
+                else:
+                    markup = types.InlineKeyboardMarkup()
+                    markup.add(
+                        types.InlineKeyboardButton("Cancel", callback_data="Cancel")
+                    )
+                    msg = sender.send_message(
+                        chat_id, f"Enter filename:", reply_markup=markup
+                    )
+                    open_session("download", msg, message.id)
+                    logger.info("/downloader")
+
+        def get_disk_stats():
+            usage = disk_stats.get(repo)
+            total, used, free = [f"{v / 2**30:.1f}" for v in usage]
+            result = f"📦 {used} / {total} Go 🟰 {free} Go 🚥"
+            if repo_alt:
+                usage = disk_stats.get(repo_alt)
+                total, used, free = [f"{v / 2**30:.1f}" for v in usage]
+                result += f"\n📦 {used} / {total} Go 🟰 {free} Go 🚥"
+            return result
+
+        def list_repo(symbol, disk="", prefix=""):
+            key = (library.version, symbol, disk, prefix.lower())
+            with views_lock:
+                if key in views:
+                    return views[key]
+            entries = library.list(disk or None)
+            if prefix:
+                entries = [
+                    e for e in entries if e["name"].lower().startswith(prefix.lower())
+                ]
+            alt_symbol = "💽" if symbol == "💿" else symbol
+            view = [
+                (
+                    f"{alt_symbol if e['disk'] == 'alt' else symbol} {e['name'][:32].capitalize()}",
+                    e,
+                )
+                for e in entries
             ]
+            keys = [position(e["disk"], e["name"]) for e in entries]
+            with views_lock:
+                views[key] = view, keys
+                while len(views) > 16:
+                    views.pop(next(iter(views)))
+            return view, keys
+
+        def position(disk, name):
+            order = [d for d, _ in library.roots]
+            return (
+                order.index(disk) if disk in order else len(order),
+                name.capitalize(),
+            )
+
+        def render_page(symbol, disk="", prefix="", cursor=None, backward=False):
+            files, keys = list_repo(symbol, disk, prefix)
+            size = 30 if symbol == "💿" else 10
+            start = 0
+            if cursor:
+                cursor = position(*cursor)
+                if backward:
+                    start = max(bisect_left(keys, cursor) - size, 0)
+                else:
+                    start = bisect_right(keys, cursor)
+                    if start >= len(files):
+                        start = max(len(files) - size, 0)
+            items = files[start : start + size]
+            markup = types.InlineKeyboardMarkup()
+            if symbol != "💿":
+                for file, entry in items:
+                    key = callbacks.register(entry["path"])
+                    markup.add(
+                        types.InlineKeyboardButton(file, callback_data=f"{symbol}{key}")
+                    )
+            row = []
+            for label, show, entry, back in [
+                ("⬅️", start > 0, items[0][1] if items else None, True),
+                (
+                    "➡️",
+                    start + size < len(files),
+                    items[-1][1] if items else None,
+                    False,
+                ),
+            ]:
+                if show:
+                    spec = [symbol, disk, prefix, entry["disk"], entry["name"], back]
+                    key = callbacks.register(json.dumps(spec))
+                    row.append(
+                        types.InlineKeyboardButton(label, callback_data=f"📄{key}")
+                    )
+            if row:
+                markup.row(*row)
+            if symbol != "💿":
+                markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
+            text = headers[symbol]
+            if "{stats}" in text:
+                text = text.format(stats=get_disk_stats())
+            if len(files) > size:
+                text += f"\n📄 {start + 1}-{start + len(items)} / {len(files)}"
+            if symbol == "💿":
+                text += "\n\n" + "\n".join(file for file, _ in items)
+            return text, markup if markup.keyboard else None
+
+        def parse_filter(message):
+            arg = message.text.split(maxsplit=1)[1:]
+            arg = arg[0].strip() if arg else ""
+            if arg.lower() in ["main", "alt"]:
+                return arg.lower(), ""
+            return "", arg
+
+        def resolve(call):
+            file_path = callbacks.resolve(call.data[1:])
+            entry = library.find(file_path) if file_path else None
+            if not entry:
+                sender.edit_message_text(
+                    "⌛ Expired, please retry.", chat_id, call.message.id
+                )
+                logger.info(f"/expired_callback: {call.data}")
+            return entry
+
+        @bot.message_handler(commands=["list"])
+        def list_files(message):
+            if message.chat.id == chat_id:
+                text, markup = render_page("💿", *parse_filter(message))
+                sender.send_message(
+                    chat_id, text, reply_markup=markup, disable_web_page_preview=True
+                )
+                logger.info(message.text)
+
+        @bot.callback_query_handler(func=lambda call: call.data.startswith("📄"))
+        def callback_page(call):
+            if call.message.chat.id == chat_id:
+                spec = callbacks.resolve(call.data[1:])
+                if not spec:
+                    sender.edit_message_text(
+                        "⌛ Expired, please retry.", chat_id, call.message.id
+                    )
+                    return
+                symbol, disk, prefix, cursor_disk, cursor, backward = json.loads(spec)
+                text, markup = render_page(
+                    symbol, disk, prefix, (cursor_disk, cursor), backward
+                )
+                sender.edit_message_text(
+                    text,
+                    chat_id,
+                    call.message.id,
+                    reply_markup=markup,
+                    disable_web_page_preview=True,
+                )
+                logger.info(f"/page: {symbol} {'⬅️' if backward else '➡️'} '{cursor}'")
+
+        @bot.callback_query_handler(func=lambda call: call.data.startswith("❌"))
+        def callback_delete(call):
+            if call.message.chat.id == chat_id:
+                entry = resolve(call)
+                if not entry:
+                    return
+                file = entry["name"]
+                torrent = qb.get_torrent(name=file)
+                if torrent:
+                    qb.delete_torrent(torrent["hash"])
+                    sender.edit_message_text(
+                        f"❌ {file.capitalize()}\n🚫 Aborted.", chat_id, call.message.id
+                    )
+                elif delete_file(file, trash, name=file, message_id=call.message.id):
+                    library.update(entry["disk"], file)
+                    sender.edit_message_text(
+                        f"❌ {file.capitalize()}\n🗑 Deleted.", chat_id, call.message.id
+                    )
+                    logger.info(f"/deleted: '{file}'")
+                sessions.close(chat_id, call.message.id)
+
+        @bot.message_handler(commands=["delete"])
+        def delete(message):
+            if message.chat.id == chat_id:
+                text, markup = render_page("❌", *parse_filter(message))
+                msg = sender.send_message(chat_id, text, reply_markup=markup)
+                open_session("delete", msg, message.id)
+                logger.info(message.text)
+
+        @bot.callback_query_handler(func=lambda call: call.data.startswith("🚚"))
+        def callback_move(call):
+            if call.message.chat.id == chat_id:
+                entry = resolve(call)
+                if not entry:
+                    return
+                file = entry["name"]
+                job = None
+                if repo_alt:
+                    pairs = [(entry["path"], path.join(repo_alt, file))]
+                    if entry["subtitles"] and not entry["is_dir"]:
+                        srt = file[:-3] + "srt"
+                        pairs.append((path.join(repo, srt), path.join(repo_alt, srt)))
+                    job = mover.submit(pairs, name=file, message_id=call.message.id)
+                if job:
+                    sender.edit_message_text(
+                        f"🚚 {file.capitalize()}\n⏳ Moving...",
+                        chat_id,
+                        call.message.id,
+                    )
+                    logger.info(f"/moving: '{file}'")
+                else:
+                    sender.edit_message_text(
+                        f"🚚 {file.capitalize()}\n🗑 Not moved.",
+                        chat_id,
+                        call.message.id,
+                    )
+                    logger.info(f"/not-moved: '{file}'")
+                sessions.close(chat_id, call.message.id)
+
+        @bot.message_handler(commands=["move"])
+        def move(message):
+            if message.chat.id == chat_id:
+                _, prefix = parse_filter(message)
+                text, markup = render_page("🚚", "main", prefix)
+                msg = sender.send_message(chat_id, text, reply_markup=markup)
+                open_session("move", msg, message.id)
+                logger.info(message.text)
+
+        @bot.callback_query_handler(func=lambda call: call.data.startswith("🔈"))
+        def callback_sub_download(call):
+            if call.message.chat.id == chat_id:
+                session = sessions.close(chat_id, call.message.id)
+                if not session or not session.get("file"):
+                    expired(call)
+                    return
+                file_buffer, subtitles_interface = session["file"], call.message.id
+                lang = call.data[1:]
+                flags = dict(eng="🇺🇸", fre="🇫🇷")
+                logger.info(f"/selected_language: {lang}")
+                searcher = subtitles_searcher
+                entry = library.get(file_buffer)
+                if entry["is_dir"]:
+                    filepath, filename = entry["path"], entry["largest"] or ""
+                else:
+                    filepath, filename = entry["root"], file_buffer
+                moviehash = None
+                if filename:
+                    try:
+                        moviehash = library.moviehash(path.join(filepath, filename))
+                    except OSError as e:
+                        logger.warning(f"/moviehash_error: {filename}: {e}")
+                subtitles = searcher.query(file_buffer, lang, moviehash=moviehash)
+                if not subtitles:
+                    text = f"🚫 No result for: {file_buffer} {flags[lang]}"
+                    sub_info = {lang: file_buffer}
+                    logger.info(f"/no_subtitles_found: {sub_info}")
+                else:
+                    sub = subtitles[0]
+                    sub_info = {lang: filename}
+                    if not filename:
+                        text = f"🚫 Empty directory error for: {file_buffer}"
+                        logger.info(f"/subtitles_empty_directory_error: {sub_info}")
+                    elif searcher.download(sub, filename[:-4], filepath):
+                        text = f"✅ Subtitles added for: {filename} {flags[lang]}"
+                        logger.info(f"/subtitles_added: {sub_info}")
+                    elif searcher.is_queued(sub):
+                        text = f"⏳ Quota reached, queued for: {filename} {flags[lang]}"
+                        logger.info(f"/subtitles_queued: {sub_info}")
+                    else:
+                        text = f"🚫 Download error for: {filename} {flags[lang]}"
+                        logger.info(f"/subtitles_download_error: {sub_info}")
+                sender.edit_message_text(text, chat_id, subtitles_interface)
+
+        @bot.callback_query_handler(func=lambda call: call.data.startswith("🖹"))
+        def callback_sub_copy(call):
+            if call.message.chat.id == chat_id:
+                session = sessions.close(chat_id, call.message.id)
+                src = callbacks.resolve(call.data[1:])
+                if not session or not src:
+                    sender.edit_message_text(
+                        "⌛ Expired, please retry.", chat_id, call.message.id
+                    )
+                    return
+                file_buffer, subtitles_interface = session["file"], call.message.id
+                sub_file = path.basename(src)
+                dst = path.join(path.dirname(path.dirname(src)), file_buffer) + ".srt"
+                copyfile(src, dst)
+                text = f"✅ Subtitles copied for: {file_buffer} from {sub_file}"
+                logger.info(f"/subtitles_copied: {file_buffer} from {sub_file}")
+                sender.edit_message_text(text, chat_id, subtitles_interface)
+
+        @bot.callback_query_handler(func=lambda call: call.data.startswith("📁"))
+        def callback_sub_local(call):
+            if call.message.chat.id == chat_id:
+                session = sessions.get(chat_id, call.message.id)
+                if not session or not session.get("file"):
+                    expired(call)
+                    return
+                file_buffer = session["file"]
+                text = f"🔈 Select .srt file for: {file_buffer}"
+                markup = types.InlineKeyboardMarkup()
+                file_path = path.join(library.get(file_buffer)["path"], "Subs")
+                for file in listdir(file_path):
+                    key = callbacks.register(path.join(file_path, file))
+                    markup.add(
+                        types.InlineKeyboardButton(file, callback_data=f"🖹{key}")
+                    )
+                markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
+                sender.edit_message_text(
+                    text, chat_id, call.message.id, reply_markup=markup
+                )
+                logger.info("/subtitles_local")
+
+        @bot.callback_query_handler(func=lambda call: call.data.startswith("💬"))
+        def callback_sub_lang(call):
+            if call.message.chat.id == chat_id:
+                entry = resolve(call)
+                if not entry:
+                    return
+                file_buffer = entry["name"]
+                if not sessions.update(chat_id, call.message.id, file=file_buffer):
+                    expired(call)
+                    return
+                logger.info(f"/selected_for_subtitles: {file_buffer}")
+                text = f"🔈 Select language for: {file_buffer}"
+                markup = types.InlineKeyboardMarkup()
+                row = []
+                if entry["subs_dir"]:
+                    row.append(
+                        types.InlineKeyboardButton("📁 From /Subs", callback_data="📁")
+                    )
+                for lang, data in [("🇺🇸 English", "🔈eng"), ("🇫🇷 French", "🔈fre")]:
+                    row.append(types.InlineKeyboardButton(lang, callback_data=data))
+                markup.row(*row)
+                markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
+                sender.edit_message_text(
+                    text, chat_id, call.message.id, reply_markup=markup
+                )
+                logger.info("/subtitles_lang")
+
+        @bot.message_handler(commands=["subtitles"])
+        def subtitles(message):
+            if message.chat.id == chat_id:
+                text, markup = render_page("💬", *parse_filter(message))
+                msg = sender.send_message(chat_id, text, reply_markup=markup)
+                open_session("subtitles", msg, message.id)
+                logger.info(message.text)
+
+        journal = Journal(path.join(state_dir, "downloads.jsonl"))
+        for info_hash, record in journal.load().items():
+            if qb.get_torrent(info_hash):
+                logger.info(f"/reattach: '{info_hash}'")
+                download_manager(record["type"], info_hash, record)
+            else:
+                journal.remove(info_hash)
+        qb.clean_torrents(keep=journal.records)
+
+        try:
+            if webhook:
+                webhook.serve()
+            else:
+                bot.infinity_polling(
+                    skip_pending=True, timeout=200, long_polling_timeout=200
+                )
+        except KeyboardInterrupt:
+            global killed
+            killed = True
+            logger.info("Mediagram - killed by KeyboardInterrupt")
+
+    finally:
+        teardown()
+
+
+async def mediagram_async():
+    from telebot.async_telebot import AsyncTeleBot
+    from telebot.asyncio_helper import ApiTelegramException
+
+    qb = AsyncQBittorrent()
+    bot = AsyncTeleBot(token)
+    global started
+
+    async def start_qbittorrent():
+        if is_rpi:
+            await qb.start()
+        await qb.init()
+
+    async def refresh_media():
+        process = await asyncio.create_subprocess_shell("/media/refresh.sh")
+        await process.wait()
+
+    steps = dict(qBittorrent=start_qbittorrent())
+    if not started:
+        steps["commands"] = bot.set_my_commands(commands=COMMANDS)
+        if is_rpi:
+            steps["media"] = refresh_media()
+    try:
+        await startup_async(steps)
+    except Exception:
+        if qb.state:
+            await qb.state.stop()
+        if qb.qb:
+            await qb.client.close()
+        await bot.close_session()
+        raise
+    bucket = TokenBucket(1, 3)
+    telegram = breaker("Telegram", retries=1, ignore=ApiTelegramException)
+
+    def build_torrent_searcher():
+        from plugins import TorrentSearch, SearchCache
+
+        search_cache = SearchCache(
+            path.join(state_dir, "search.db"),
+            ttl=search_ttl,
+            negative_ttl=search_negative_ttl,
         )
-    safe = SafeRequest()
+        return TorrentSearch(search_cache, torrent_providers)
+
+    torrent_searcher = Lazy(build_torrent_searcher)
     started = dt.fromtimestamp(now()).strftime("%Y-%m-%d  -  %H:%M:%S")
-    signal = Event()
-    signal.set()
-    threads = []
-    id_stack, id_magnet, file_buffer = [], {}, ""
-    bot.send_message(chat_id, "🟢 Started.")
-    logger.info("Mediagram - initialized")
+    monitors, hashes = set(), set()
+    sessions = Sessions()
+
+    async def call(method, *args, **kwargs):
+        while True:
+            await asyncio.sleep(bucket.delay())
+            bucket.take()
+            try:
+                return await telegram.acall(method, *args, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = e.result_json.get("parameters", {}).get(
+                        "retry_after", 1
+                    )
+                    logger.warning(f"Telegram - flood limit, retry in {retry_after}s")
+                    bucket.block(retry_after)
+                    continue
+                if "message is not modified" not in e.description:
+                    logger.warning(f"Telegram - {method.__name__} failed: {e}")
+                return
+
+    await call(bot.send_message, chat_id, "🟢 Started.")
+    logger.info("Mediagram - initialized (asyncio)")
 
     @bot.message_handler(commands=["start", "alive"])
-    def alive(message):
+    async def alive(message):
         if message.chat.id == chat_id:
-            bot.send_message(chat_id, f"⏰ Started at:\n{started}\n🟢 Running...")
+            await call(
+                bot.send_message, chat_id, f"⏰ Started at:\n{started}\n🟢 Running..."
+            )
             logger.info(message.text)
 
     @bot.message_handler(commands=["force"])
-    def force(message):
+    async def force(message):
         if message.chat.id == chat_id:
-            run("/media/refresh.sh", shell=True)
-            bot.send_message(chat_id, "♻️ Force media refresh: Done.")
+            process = await asyncio.create_subprocess_shell("/media/refresh.sh")
+            await process.wait()
+            await call(bot.send_message, chat_id, "♻️ Force media refresh: Done.")
             logger.info("/force: media-refresh")
 
     @bot.message_handler(commands=["alt"])
-    def alt(message):
+    async def alt(message):
         if message.chat.id == chat_id:
-            run("/media/mount.sh", shell=True)
-            bot.send_message(chat_id, "💽 Alt disk mounted: Done.")
+            process = await asyncio.create_subprocess_shell("/media/mount.sh")
+            await process.wait()
+            await call(bot.send_message, chat_id, "💽 Alt disk mounted: Done.")
             logger.info("/alt: mounted")
 
     @bot.message_handler(commands=["ip"])
-    def get_ip(message):
+    async def get_ip(message):
         if message.chat.id == chat_id:
-            ip = get_public_ip()
+            from plugins import get_public_ip
+
+            ip = await asyncio.to_thread(get_public_ip)
             if not ip:
                 ip = "Error when checking IP."
-            bot.send_message(chat_id, ip)
+            await call(bot.send_message, chat_id, ip)
             logger.info(f"/ip: {ip}")
 
     @bot.message_handler(commands=["stop", "restart"])
-    def kill(message):
+    async def kill(message):
         if message.chat.id == chat_id:
             if message.text == "/stop":
                 global killed
                 killed = True
-                bot.send_message(chat_id, "🟠 Stopping...")
+                await call(bot.send_message, chat_id, "🟠 Stopping...")
             else:
-                bot.send_message(chat_id, "🔵 Restarting...")
+                await call(bot.send_message, chat_id, "🔵 Restarting...")
             logger.info(message.text)
-            signal.clear()
-            for thread in threads:
-                thread.join()
-            bot.stop_polling()
-            qb.close()
-            if is_rpi:
-                qb.stop()
-            bot.send_message(chat_id, "🔴 Shutdown.")
+            bot._polling = False
+            for task in monitors:
+                task.cancel()
+            await asyncio.gather(*monitors, return_exceptions=True)
+            await call(bot.send_message, chat_id, "🔴 Shutdown.")
             logger.info("Mediagram - shutdown")
 
     @bot.message_handler(commands=["help"])
-    def help(message):
+    async def help(message):
         if message.chat.id == chat_id:
-            bot.send_message(
+            await call(
+                bot.send_message,
                 chat_id,
                 "📝 Send a .torrent file or a magnet link to download it on your Raspberry Pi.",
             )
             logger.info(message.text)
 
     @bot.callback_query_handler(func=lambda call: call.data == "Cancel")
-    def cancel(call):
-        if call.message.chat.id == chat_id:
-            nonlocal id_stack, id_magnet, file_buffer
-            for _, id in id_stack:
-                bot.delete_message(chat_id, id)
-            id_stack, id_magnet, file_buffer = [], {}, ""
+    async def cancel(query):
+        if query.message.chat.id == chat_id:
+            session = sessions.close(chat_id, query.message.id)
+            messages = session["messages"] if session else [query.message.id]
+            for id in messages:
+                await call(bot.delete_message, chat_id, id)
             logger.info("/cancel")
 
-    def delete_file(name):
-        file = path.join(repo, name)
-        if not path.exists(file) and repo_alt:
-            file = path.join(repo_alt, name)
-        srt = file[:-3] + "srt"
-        if path.isfile(file):
-            remove(file)
-            if path.isfile(srt):
-                remove(srt)
-            return True
-        elif path.isdir(file):
-            rmtree(file, ignore_errors=True)
-            return True
-        return False
-
-    def move_to_alt(name):
-        src = path.join(repo, name)
-        if path.exists(src) and repo_alt:
-            dst = path.join(repo_alt, name)
-            try:
-                if path.isdir(src):
-                    copytree(src, dst, dirs_exist_ok=True)
-                else:
-                    copyfile(src, dst)
-                # return delete_file(name)
-            except:
-                pass
-        return False
-
-    def download_manager(torrent_type, signal):
-        info = qb.log_torrent(new=True)
-        file, name, info_hash = info["name"], info["name"].capitalize(), info["hash"]
-        qb.only_sequential(info_hash)
+    async def download_manager(torrent_type, info_hash):
+        version = qb.state.versions.get(info_hash, 0)
+        try:
+            while not qb.state.get(info_hash):
+                version = await asyncio.wait_for(
+                    qb.state.wait_change(info_hash, version), 10
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"Torrent not found: '{info_hash}'")
+            return
+        info = qb.log_torrent(info_hash=info_hash)
+        file, name = info["name"], info["name"].capitalize()
+        await qb.only_sequential(info_hash)
         logger.info(f"/download: '{file}'")
         base = f"🌐 {name}\n🔥 {torrent_type} processed\n"
-        msg = bot.send_message(chat_id, f"{base}{info['details']}")
-        while signal.is_set() and not info["done"]:
-            sleep(2)
-            released = False
-            while not released:
+        msg = await call(bot.send_message, chat_id, f"{base}{info['details']}")
+        try:
+            while not info["done"]:
+                await asyncio.sleep(2)
+                version = await qb.state.wait_change(info_hash, version)
                 new_info = qb.log_torrent(info_hash=info_hash)
-                if safe.is_releasable():
-                    if not new_info:
-                        delete_file(file)
-                        bot.edit_message_text(f"{base}🚫 Aborted.", chat_id, msg.id)
-                        logger.info(f"/aborted: '{file}'")
-                        return
-                    if info != new_info:
-                        info = new_info
-                        bot.edit_message_text(
-                            f"{base}{info['details']}", chat_id, msg.id
+                if not new_info:
+                    await asyncio.to_thread(delete_file, file)
+                    if msg:
+                        await call(
+                            bot.edit_message_text, f"{base}🚫 Aborted.", chat_id, msg.id
                         )
-                    released = safe.release()
-        qb.delete_torrent(info_hash)
-        if info["done"]:
-            bot.delete_message(chat_id, msg.id)
-            bot.send_message(chat_id, f"{base}✅ Completed. Ready to play!")
-            logger.info(f"/done: '{file}'")
-        else:
-            delete_file(file)
-            bot.edit_message_text(f"{base}🚫 Aborted.", chat_id, msg.id)
+                    logger.info(f"/aborted: '{file}'")
+                    return
+                if info != new_info:
+                    info = new_info
+                    if not msg:
+                        msg = await call(
+                            bot.send_message, chat_id, f"{base}{info['details']}"
+                        )
+                        continue
+                    await call(
+                        bot.edit_message_text,
+                        f"{base}{info['details']}",
+                        chat_id,
+                        msg.id,
+                    )
+        except asyncio.CancelledError:
+            await qb.delete_torrent(info_hash)
+            await asyncio.to_thread(delete_file, file)
+            if msg:
+                await call(bot.edit_message_text, f"{base}🚫 Aborted.", chat_id, msg.id)
             logger.info(f"/aborted: '{file}'")
+            raise
+        await qb.delete_torrent(info_hash)
+        if msg:
+            await call(bot.delete_message, chat_id, msg.id)
+        await call(bot.send_message, chat_id, f"{base}✅ Completed. Ready to play!")
+        logger.info(f"/done: '{file}'")
+
+    def monitored(task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"Monitor - download failed: {task.exception()!r}")
+
+    def monitor(torrent_type, info_hash):
+        if info_hash in hashes:
+            logger.info(f"/already_downloading: '{info_hash}'")
+            return
+        task = asyncio.create_task(download_manager(torrent_type, info_hash))
+        hashes.add(info_hash)
+        task.add_done_callback(lambda _: hashes.discard(info_hash))
+        monitors.add(task)
+        task.add_done_callback(monitors.discard)
+        task.add_done_callback(monitored)
 
     @bot.message_handler(
         func=lambda message: message.document.mime_type == "application/x-bittorrent",
         content_types=["document"],
     )
-    def upload_torrent_file(message):
+    async def upload_torrent_file(message):
         if message.chat.id == chat_id:
-            file_info = bot.get_file(message.document.file_id)
-            torrent = bot.download_file(file_info.file_path)
+            file_info = await bot.get_file(message.document.file_id)
+            torrent = await bot.download_file(file_info.file_path)
             if not path.exists(repo):
                 logger.error(f"Missing directory: '{repo}'")
-            elif not signal.is_set():
-                logger.info("/download-blocked - Torrent file")
             else:
                 logger.info(f"/upload_torrent_file: '{message.document.file_name}'")
-                qb.download_from_torrent_file(torrent)
-                bot.delete_message(chat_id, message.id)
-                thread = Thread(target=download_manager, args=("Torrent file", signal))
-                thread.start()
-                threads.append(thread)
+                try:
+                    info_hash = await qb.download_from_torrent_file(torrent)
+                except ValueError as e:
+                    logger.error(f"Invalid torrent file: {e}")
+                    return
+                await call(bot.delete_message, chat_id, message.id)
+                monitor("Torrent file", info_hash)
 
     @bot.message_handler(
         func=lambda message: message.text.startswith("magnet:?xt="),
         content_types=["text"],
     )
-    def upload_magnet_link(message):
+    async def upload_magnet_link(message):
         if message.chat.id == chat_id:
             if not path.exists(repo):
                 logger.error(f"Missing directory: '{repo}'")
-            elif not signal.is_set():
-                logger.info("/download-blocked - Magnet link")
             else:
                 logger.info(f"/upload_magnet_link: '{message.text}'")
-                qb.download_from_magnet_link(message.text)
-                bot.delete_message(chat_id, message.id)
-                thread = Thread(target=download_manager, args=("Magnet link", signal))
-                thread.start()
-                threads.append(thread)
+                try:
+                    info_hash = await qb.download_from_magnet_link(message.text)
+                except ValueError as e:
+                    logger.error(e)
+                    return
+                await call(bot.delete_message, chat_id, message.id)
+                monitor("Magnet link", info_hash)
 
     @bot.callback_query_handler(
         func=lambda call: call.data in ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣"]
     )
-    def callback_select(call):
-        if call.message.chat.id == chat_id:
-            logger.info(f"/selected: {call.data}")
-            if not signal.is_set():
-                logger.info("/download-blocked - Magnet link")
-            else:
-                nonlocal id_stack, id_magnet
-                magnet = id_magnet[call.data]
-                logger.info(f"/retrieved_magnet_link: '{magnet}'")
-                qb.download_from_magnet_link(magnet)
-                for _, id in id_stack[1:]:
-                    bot.delete_message(chat_id, id)
-                id_stack, id_magnet = [], {}
-                thread = Thread(target=download_manager, args=("Magnet link", signal))
-                thread.start()
-                threads.append(thread)
+    async def callback_select(query):
+        if query.message.chat.id == chat_id:
+            logger.info(f"/selected: {query.data}")
+            session = sessions.close(chat_id, query.message.id)
+            if not session:
+                await call(
+                    bot.edit_message_text,
+                    "⌛ Expired, please retry.",
+                    chat_id,
+                    query.message.id,
+                )
+                logger.info(f"/expired_session: {query.data}")
+                return
+            magnet = session["magnets"][query.data]
+            logger.info(f"/retrieved_magnet_link: '{magnet}'")
+            info_hash = await qb.download_from_magnet_link(magnet)
+            for id in session["messages"][1:]:
+                await call(bot.delete_message, chat_id, id)
+            monitor("Magnet link", info_hash)
 
     @bot.message_handler(
         func=lambda m: not list(
@@ -376,319 +2340,85 @@ def mediagram():
         ),
         content_types=["text"],
     )
-    def torrent_select(message):
+    async def torrent_select(message):
         if message.chat.id == chat_id:
             logger.info(f"/request: '{message.text}'")
-            searcher = TorrentSearch()
-            retry = 0
-            while retry < 3:
-                retry += 1
-                torrents = searcher.query(message.text)
-                if torrents:
-                    break
-            nonlocal id_stack
-            id_stack.append(("download_reply", message.id))
+            prompt = sessions.close_latest(chat_id, "download")
+            messages = (*(prompt["messages"] if prompt else ()), message.id)
+            searcher = await asyncio.to_thread(torrent_searcher.get)
+            torrents = await asyncio.to_thread(searcher.query, message.text)
             if not torrents:
-                bot.send_message(chat_id, f"🚫 No result for: {message.text}")
-                for _, id in id_stack[1:]:
-                    bot.delete_message(chat_id, id)
-                id_stack = []
+                await call(
+                    bot.send_message, chat_id, f"🚫 No result for: {message.text}"
+                )
+                for id in messages[1:]:
+                    await call(bot.delete_message, chat_id, id)
                 logger.info("/no_result")
             else:
                 text = f"⛳️ Results for: {message.text}\n"
                 markup = types.InlineKeyboardMarkup()
-                row = []
-                nonlocal id_magnet
+                row, magnets = [], {}
                 for i, t in zip(["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣"], torrents):
                     text += f"\n{i} {t['name']}\n💾 {t['size']} Go 🔗 {t['seeders']} 👤 {t['leechers']}\n⏰ {t['date']}\n"
                     row.append(types.InlineKeyboardButton(i, callback_data=i))
-                    id_magnet[i] = t["magnet"]
+                    magnets[i] = t["magnet"]
                 markup.row(*row)
                 markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
-                msg = bot.send_message(chat_id, text, reply_markup=markup)
-                id_stack.append(("download_choose", msg.id))
+                msg = await call(bot.send_message, chat_id, text, reply_markup=markup)
+                if not msg:
+                    logger.error("/torrent_select: results not sent")
+                    return
+                sessions.open(
+                    chat_id, msg.id, "results", *messages, msg.id, magnets=magnets
+                )
                 logger.info("/torrent_select")
 
     @bot.message_handler(commands=["download"])
-    def downloader(message):
+    async def downloader(message):
         if message.chat.id == chat_id:
             if not path.exists(repo):
                 logger.error(f"Missing directory: '{repo}'")
             else:
                 markup = types.InlineKeyboardMarkup()
                 markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
-                msg = bot.send_message(chat_id, f"Enter filename:", reply_markup=markup)
-                id_stack.append(("download_init", message.id))
-                id_stack.append(("download_enter", msg.id))
-                logger.info("/downloader")
-
-    def get_disk_stats():
-        usage = disk_usage(repo)
-        total, used, free = [f"{v / 2**30:.1f}" for v in usage]
-        result = f"📦 {used} / {total} Go 🟰 {free} Go 🚥"
-        if repo_alt:
-            usage = disk_usage(repo_alt)
-            total, used, free = [f"{v / 2**30:.1f}" for v in usage]
-            result += f"\n📦 {used} / {total} Go 🟰 {free} Go 🚥"
-        return result
-
-    def list_repo(symbol, all=True):
-        ignored = ["System Volume Information", "$RECYCLE.BIN"]
-        files = sorted(
-            [
-                f"{symbol} {f[:32].capitalize()}"
-                for f in listdir(repo)
-                if f not in ignored and not f.endswith(".srt") and not f.startswith(".")
-            ]
-        )
-        if repo_alt and all:
-            if symbol == "💿":
-                symbol = "💽"
-            files += sorted(
-                [
-                    f"{symbol} {f[:32].capitalize()}"
-                    for f in listdir(repo_alt)
-                    if f not in ignored
-                    and not f.endswith(".srt")
-                    and not f.startswith(".")
-                ]
-            )
-        return files
-
-    @bot.message_handler(commands=["list"])
-    def list_files(message):
-        if message.chat.id == chat_id:
-            files = "\n".join(list_repo("💿"))
-            bot.send_message(
-                chat_id,
-                f"💾 Available files 💾\n{get_disk_stats()}\n\n{files}",
-                disable_web_page_preview=True,
-            )
-            logger.info(message.text)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("❌"))
-    def callback_delete(call):
-        if call.message.chat.id == chat_id:
-            file = [
-                f for f in listdir(repo) if f.capitalize().startswith(call.data[2:])
-            ]
-            if repo_alt:
-                file += [
-                    f
-                    for f in listdir(repo_alt)
-                    if f.capitalize().startswith(call.data[2:])
-                ]
-            file = file[0]
-            torrent = qb.get_torrent(name=file)
-            if torrent:
-                qb.delete_torrent(torrent["hash"])
-                bot.edit_message_text(
-                    f"❌ {file.capitalize()}\n🚫 Aborted.", chat_id, call.message.id
-                )
-            elif delete_file(file):
-                bot.edit_message_text(
-                    f"❌ {file.capitalize()}\n🗑 Deleted.", chat_id, call.message.id
-                )
-                logger.info(f"/deleted: '{file}'")
-            nonlocal id_stack
-            id_stack = []
-
-    @bot.message_handler(commands=["delete"])
-    def delete(message):
-        if message.chat.id == chat_id:
-            markup = types.InlineKeyboardMarkup()
-            for file in list_repo("❌"):
-                markup.add(types.InlineKeyboardButton(file, callback_data=file))
-            markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
-            msg = bot.send_message(
-                chat_id,
-                f"❌ Available files to delete ❌\n{get_disk_stats()}",
-                reply_markup=markup,
-            )
-            id_stack.append(("delete_init", message.id))
-            id_stack.append(("delete_select", msg.id))
-            logger.info(message.text)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("🚚"))
-    def callback_move(call):
-        if call.message.chat.id == chat_id:
-            file = [
-                f for f in listdir(repo) if f.capitalize().startswith(call.data[2:])
-            ][0]
-            move_to_alt(file)
-            if path.exists(repo_alt + file):
-                bot.edit_message_text(
-                    f"🚚 {file.capitalize()}\n🗑 Moved.", chat_id, call.message.id
-                )
-                logger.info(f"/moved: '{file}'")
-            else:
-                bot.edit_message_text(
-                    f"🚚 {file.capitalize()}\n🗑 Not moved.", chat_id, call.message.id
+                msg = await call(
+                    bot.send_message, chat_id, f"Enter filename:", reply_markup=markup
                 )
-                logger.info(f"/not-moved: '{file}'")
-            nonlocal id_stack
-            id_stack = []
-
-    @bot.message_handler(commands=["move"])
-    def move(message):
-        if message.chat.id == chat_id:
-            markup = types.InlineKeyboardMarkup()
-            for file in list_repo("🚚", all=False):
-                markup.add(types.InlineKeyboardButton(file, callback_data=file))
-            markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
-            msg = bot.send_message(
-                chat_id,
-                f"🚚 Available files to move 🚚\n{get_disk_stats()}",
-                reply_markup=markup,
-            )
-            id_stack.append(("move_init", message.id))
-            id_stack.append(("move_select", msg.id))
-            logger.info(message.text)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("🔈"))
-    def callback_sub_download(call):
-        if call.message.chat.id == chat_id:
-            nonlocal id_stack, file_buffer
-            subtitles_interface = id_stack[-1][1]
-            lang = call.data[1:]
-            flags = dict(eng="🇺🇸", fre="🇫🇷")
-            logger.info(f"/selected_language: {lang}")
-            searcher = SubtitlesSearchV2(ost_user, ost_pass, ost_apikey)
-            retry = 0
-            while retry < 3:
-                retry += 1
-                subtitles = searcher.query(file_buffer, lang)
-                if subtitles:
-                    break
-                sleep(1)
-            if not subtitles:
-                text = f"🚫 No result for: {file_buffer} {flags[lang]}"
-                sub_info = {lang: file_buffer}
-                logger.info(f"/no_subtitles_found: {sub_info}")
-            else:
-                file, temp_repo = path.join(repo, file_buffer), repo
-                if not path.exists(file) and repo_alt:
-                    file, temp_repo = path.join(repo_alt, file_buffer), repo_alt
-                if path.isdir(file):
-                    filepath, filename, size = file, "", 0
-                    for f in listdir(filepath):
-                        s = path.getsize(path.join(filepath, f))
-                        if s > size:
-                            filename, size = f, s
-                    if size == 0:
-                        text = f"🚫 Empty directory error for: {file_buffer}"
-                        logger.info(f"/subtitles_empty_directory_error: {sub_info}")
-                else:
-                    filepath, filename = temp_repo, file_buffer
-                sub = subtitles[0]
-                sub_info = {lang: filename}
-                if searcher.download(sub, filename[:-4], filepath):
-                    text = f"✅ Subtitles added for: {filename} {flags[lang]}"
-                    logger.info(f"/subtitles_added: {sub_info}")
-                else:
-                    text = f"🚫 Download error for: {filename} {flags[lang]}"
-                    logger.info(f"/subtitles_download_error: {sub_info}")
-            id_stack, file_buffer = [], ""
-            bot.edit_message_text(text, chat_id, subtitles_interface)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("🖹"))
-    def callback_sub_copy(call):
-        if call.message.chat.id == chat_id:
-            nonlocal id_stack, file_buffer
-            subtitles_interface = id_stack[-1][1]
-            sub_file = call.data[1:]
-            src = path.join(repo, file_buffer, "Subs", sub_file)
-            dst = path.join(repo, file_buffer, file_buffer) + ".srt"
-            if not path.exists(src) and repo_alt:
-                src = path.join(repo_alt, file_buffer, "Subs", sub_file)
-                dst = path.join(repo_alt, file_buffer, file_buffer) + ".srt"
-            copyfile(src, dst)
-            text = f"✅ Subtitles copied for: {file_buffer} from {sub_file}"
-            logger.info(f"/subtitles_copied: {file_buffer} from {sub_file}")
-            id_stack, file_buffer = [], ""
-            bot.edit_message_text(text, chat_id, subtitles_interface)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("📁"))
-    def callback_sub_local(call):
-        if call.message.chat.id == chat_id:
-            text = f"🔈 Select .srt file for: {file_buffer}"
-            markup = types.InlineKeyboardMarkup()
-            file_path = path.join(repo, file_buffer, "Subs")
-            if not path.exists(file_path) and repo_alt:
-                file_path = path.join(repo_alt, file_buffer, "Subs")
-            for file in listdir(file_path):
-                markup.add(types.InlineKeyboardButton(file, callback_data=f"🖹{file}"))
-            markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
-            bot.edit_message_text(text, chat_id, id_stack[-1][1], reply_markup=markup)
-            logger.info("/subtitles_local")
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("💬"))
-    def callback_sub_lang(call):
-        if call.message.chat.id == chat_id:
-            nonlocal file_buffer
-            file_buffer = [
-                f for f in listdir(repo) if f.capitalize().startswith(call.data[2:])
-            ]
-            if repo_alt:
-                file_buffer += [
-                    f
-                    for f in listdir(repo_alt)
-                    if f.capitalize().startswith(call.data[2:])
-                ]
-            file_buffer = file_buffer[0]
-            logger.info(f"/selected_for_subtitles: {file_buffer}")
-            text = f"🔈 Select language for: {file_buffer}"
-            markup = types.InlineKeyboardMarkup()
-            row = []
-            file_path = path.join(repo, file_buffer)
-            if not path.exists(file_path) and repo_alt:
-                file_path = path.join(repo_alt, file_buffer)
-            if path.isdir(file_path) and path.isdir(path.join(file_path, "Subs")):
-                row.append(
-                    types.InlineKeyboardButton("📁 From /Subs", callback_data="📁")
-                )
-            for lang, data in [("🇺🇸 English", "🔈eng"), ("🇫🇷 French", "🔈fre")]:
-                row.append(types.InlineKeyboardButton(lang, callback_data=data))
-            markup.row(*row)
-            markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
-            bot.edit_message_text(text, chat_id, id_stack[-1][1], reply_markup=markup)
-            logger.info("/subtitles_lang")
-
-    @bot.message_handler(commands=["subtitles"])
-    def subtitles(message):
-        if message.chat.id == chat_id:
-            markup = types.InlineKeyboardMarkup()
-            for file in list_repo("💬"):
-                markup.add(types.InlineKeyboardButton(file, callback_data=file))
-            markup.add(types.InlineKeyboardButton("Cancel", callback_data="Cancel"))
-            msg = bot.send_message(
-                chat_id, f"🪄 Add subtitles for:", reply_markup=markup
-            )
-            id_stack.append(("subtitles_init", message.id))
-            id_stack.append(("subtitles_interface", msg.id))
-            logger.info(message.text)
+                if not msg:
+                    logger.error("/downloader: prompt not sent")
+                    return
+                sessions.open(chat_id, msg.id, "download", message.id, msg.id)
+                logger.info("/downloader")
 
     try:
-        bot.infinity_polling(skip_pending=True, timeout=200, long_polling_timeout=200)
-    except KeyboardInterrupt:
-        global killed
-        killed = True
-        logger.info("Mediagram - killed by KeyboardInterrupt")
-        signal.clear()
-        for thread in threads:
-            thread.join()
-        qb.close()
+        await bot.infinity_polling(skip_pending=True, timeout=200, request_timeout=200)
+    finally:
+        for task in monitors:
+            task.cancel()
+        await asyncio.gather(*monitors, return_exceptions=True)
+        await qb.close()
         if is_rpi:
-            qb.stop()
-        return
-    except Exception:
-        pass
+            await qb.stop()
+        await qb.client.close()
+        await bot.close_session()
 
 
 if __name__ == "__main__":
+    crashes = 0
     while not killed:
+        started_at = now()
         try:
-            mediagram()
+            if async_mode:
+                asyncio.run(mediagram_async())
+            else:
+                mediagram()
         except KeyboardInterrupt:
             killed = True
             logger.info("Mediagram - killed by KeyboardInterrupt")
+        except Exception:
+            crashes = crashes + 1 if now() - started_at < 5 * 60 else 1
+            delay = backoff(crashes, base=2, cap=120)
+            logger.exception(
+                f"Mediagram - crashed ({crashes}), restart in {delay:.1f}s"
+            )
+            sleep(delay)
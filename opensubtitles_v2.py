@@ -1,48 +1,129 @@
 import os
 import requests
 import json
+import tempfile
+from base64 import urlsafe_b64decode
+from datetime import datetime
+from threading import Lock, RLock, Timer
+from time import time
 from urllib.parse import urlencode
+from logging import getLogger
+
+logger = getLogger("rich")
 
 
 class OpenSubtitlesV2:
-    def __init__(self):
+    API = "https://api.opensubtitles.com/api/v1"
+
+    def __init__(self, cache=None, timeout=15, retries=5):
+        self.timeout = timeout
+        self.retries = retries
         self.login_token = None
+        self.token_expires = 0
         self.user_downloads_remaining = None
+        self.quota_reset = 0
+        self.queued = []
+        self.timer = None
+        self.stopped = False
+        self.on_download = None
+        self.cache = cache
+        self.lock = RLock()
+        self.save_lock = Lock()
+        self.session = requests.Session()
+        self.session.headers.update({"user-agent": "Mediagram v1"})
 
     def login(self, user, password, apikey):
         self.user = user
         self.password = password
         self.apikey = apikey
+        self.session.headers.update({"api-key": self.apikey})
+        self.load()
 
-        login_url = "https://api.opensubtitles.com/api/v1/login"
-        login_headers = {
-            "api-key": self.apikey,
-            "content-type": "application/json",
-            "user-agent": "Mediagram v1",
-        }
+    def load(self):
+        if not self.cache or not os.path.exists(self.cache):
+            return
+        try:
+            with open(self.cache) as f:
+                cached = json.load(f)
+        except ValueError:
+            return
+        if cached.get("user") == self.user and cached.get("expires", 0) > time():
+            self.login_token = cached["token"]
+            self.token_expires = cached["expires"]
+            self.user_downloads_remaining = cached.get("remaining")
+        self.quota_reset = cached.get("reset", 0)
+        self.queued = cached.get("queued", [])
+        self.arm()
+
+    def save(self):
+        if not self.cache:
+            return
+        with self.lock:
+            state = dict(
+                user=self.user,
+                token=self.login_token,
+                expires=self.token_expires,
+                remaining=self.user_downloads_remaining,
+                reset=self.quota_reset,
+                queued=[list(item) for item in self.queued],
+            )
+        with self.save_lock:
+            fd, temp = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.cache)), suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(state, f)
+                os.replace(temp, self.cache)
+            except BaseException:
+                os.remove(temp)
+                raise
+
+    def token_expiry(self, token):
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            return json.loads(urlsafe_b64decode(payload))["exp"] - 60
+        except (IndexError, KeyError, ValueError):
+            return time() + 23 * 60 * 60
+
+    def ensure_login(self):
+        with self.lock:
+            if not self.login_token or self.token_expires < time():
+                self.authenticate()
+            if self.user_downloads_remaining is None:
+                self.user_info()
+
+    def authenticate(self):
+        login_url = f"{self.API}/login"
         login_body = {"username": self.user, "password": self.password}
         try:
-            login_response = requests.post(
-                login_url, data=json.dumps(login_body), headers=login_headers
+            login_response = self.session.post(
+                login_url,
+                data=json.dumps(login_body),
+                headers={"content-type": "application/json"},
+                timeout=self.timeout,
             )
             login_response.raise_for_status()
             login_json_response = login_response.json()
             self.login_token = login_json_response["token"]
+            self.token_expires = self.token_expiry(self.login_token)
         except requests.exceptions.HTTPError as httperr:
             raise Exception(httperr)
         except requests.exceptions.RequestException as reqerr:
-            raise Exception("Failed to login: " + reqerr)
+            raise Exception(f"Failed to login: {reqerr}")
         except ValueError as e:
-            raise Exception("Failed to parse login JSON response: " + e)
+            raise Exception(f"Failed to parse login JSON response: {e}")
+        self.user_info()
 
-        user_url = "https://api.opensubtitles.com/api/v1/infos/user"
-        user_headers = {
-            "api-key": self.apikey,
-            "authorization": self.login_token,
-            "user-agent": "Mediagram v1",
-        }
+    def user_info(self):
+        user_url = f"{self.API}/infos/user"
         try:
-            user_response = requests.get(user_url, headers=user_headers)
+            user_response = self.session.get(
+                user_url,
+                headers={"authorization": self.login_token},
+                timeout=self.timeout,
+            )
             user_response.raise_for_status()
             user_json_response = user_response.json()
             self.user_downloads_remaining = user_json_response["data"][
@@ -51,11 +132,12 @@ class OpenSubtitlesV2:
         except requests.exceptions.HTTPError as httperr:
             raise Exception(httperr)
         except requests.exceptions.RequestException as reqerr:
-            raise Exception("Failed to login: " + reqerr)
+            raise Exception(f"Failed to login: {reqerr}")
         except ValueError as e:
-            raise Exception("Failed to parse user JSON response: " + e)
+            raise Exception(f"Failed to parse user JSON response: {e}")
+        self.save()
 
-    def search_subtitles(self, filename, sublanguage):
+    def search_subtitles(self, filename, sublanguage, moviehash=None):
         try:
             query_params = {
                 "foreign_parts_only": "exclude",
@@ -64,11 +146,12 @@ class OpenSubtitlesV2:
                 "order_direction": "desc",
                 "query": filename.lower(),
             }
-            query_params = urlencode(query_params)
-            query_url = "https://api.opensubtitles.com/api/v1/subtitles"
-            query_headers = {"api-key": self.apikey, "user-agent": "Mediagram v1"}
-            query_response = requests.get(
-                query_url, params=query_params, headers=query_headers
+            if moviehash:
+                query_params["moviehash"] = moviehash
+            query_params = urlencode(sorted(query_params.items()))
+            query_url = f"{self.API}/subtitles"
+            query_response = self.session.get(
+                query_url, params=query_params, timeout=self.timeout
             )
             query_response.raise_for_status()
             query_json_response = query_response.json()
@@ -77,39 +160,133 @@ class OpenSubtitlesV2:
         except requests.exceptions.HTTPError as httperr:
             raise Exception(httperr)
         except requests.exceptions.RequestException as reqerr:
-            raise Exception("Failed to login: " + reqerr)
+            raise Exception(f"Failed to search: {reqerr}")
         except ValueError as e:
-            raise Exception("Failed to parse search_subtitle JSON response: " + e)
+            raise Exception(f"Failed to parse search_subtitle JSON response: {e}")
 
     def download_subtitle(self, id, name, path):
-        download_url = "https://api.opensubtitles.com/api/v1/download"
+        self.ensure_login()
+        if self.quota_exhausted():
+            self.queue_subtitle(id, name, path)
+            return None
+        download_url = f"{self.API}/download"
         download_headers = {
-            "api-key": self.apikey,
             "authorization": self.login_token,
             "content-type": "application/json",
-            "user-agent": "Mediagram v1",
         }
         download_body = {"file_id": id}
-        if self.user_downloads_remaining > 0:
-            try:
-                download_response = requests.post(
+        try:
+            download_response = self.session.post(
+                download_url,
+                data=json.dumps(download_body),
+                headers=download_headers,
+                timeout=self.timeout,
+            )
+            if download_response.status_code == 401:
+                self.login_token = None
+                self.ensure_login()
+                download_headers["authorization"] = self.login_token
+                download_response = self.session.post(
                     download_url,
                     data=json.dumps(download_body),
                     headers=download_headers,
+                    timeout=self.timeout,
                 )
-                download_json_response = download_response.json()
-                self.user_downloads_remaining = download_json_response["remaining"]
-                download_link = download_json_response["link"]
-                download_remote_file = requests.get(download_link)
-                file = os.path.join(path, name)
-                with open(file, "wb") as f:
-                    f.write(download_remote_file.content)
-                    return {id: file}
-            except requests.exceptions.HTTPError as httperr:
-                raise Exception(httperr)
-            except requests.exceptions.RequestException as reqerr:
-                raise Exception("Failed to login: " + reqerr)
-            except ValueError as e:
-                raise Exception("Failed to parse search_subtitle JSON response: " + e)
-        else:
-            print("Download limit reached. Wait for your quota to reset (~24hrs)")
+            download_json_response = download_response.json()
+            self.track_quota(download_json_response)
+            if "link" not in download_json_response:
+                if (self.user_downloads_remaining or 0) > 0:
+                    download_response.raise_for_status()
+                    raise ValueError("missing download link")
+                self.queue_subtitle(id, name, path)
+                return None
+            file = os.path.join(path, name)
+            temp = os.path.join(path, f".{name}.part")
+            with self.session.get(
+                download_json_response["link"],
+                headers={"api-key": None},
+                stream=True,
+                timeout=self.timeout,
+            ) as download_remote_file:
+                download_remote_file.raise_for_status()
+                with open(temp, "wb") as f:
+                    for chunk in download_remote_file.iter_content(64 * 1024):
+                        f.write(chunk)
+            os.replace(temp, file)
+            return {id: file}
+        except requests.exceptions.HTTPError as httperr:
+            raise Exception(httperr)
+        except requests.exceptions.RequestException as reqerr:
+            raise Exception(f"Failed to download: {reqerr}")
+        except ValueError as e:
+            raise Exception(f"Failed to parse download JSON response: {e}")
+
+    def download_subtitles(self, items):
+        files = {}
+        for id, name, path in items:
+            files.update(self.download_subtitle(id, name, path) or {})
+        return files
+
+    def track_quota(self, response):
+        if "remaining" in response:
+            self.user_downloads_remaining = response["remaining"]
+        if response.get("reset_time_utc"):
+            reset = response["reset_time_utc"].replace("Z", "+00:00")
+            self.quota_reset = datetime.fromisoformat(reset).timestamp()
+        self.save()
+
+    def quota_exhausted(self):
+        return (
+            self.user_downloads_remaining is not None
+            and self.user_downloads_remaining <= 0
+            and self.quota_reset > time()
+        )
+
+    def queue_subtitle(self, id, name, path, attempts=0):
+        with self.lock:
+            if all(item[0] != id for item in self.queued):
+                self.queued.append([id, name, path, attempts])
+        self.save()
+        self.arm()
+
+    def arm(self):
+        with self.lock:
+            if self.stopped or not self.queued:
+                return
+            if self.timer and self.timer.is_alive():
+                return
+            self.timer = Timer(max(self.quota_reset - time(), 0) + 60, self.drain)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+    def drain(self):
+        with self.lock:
+            if self.stopped:
+                return
+            items, self.queued = self.queued, []
+            self.timer = None
+        self.save()
+        for i, (id, name, path, *attempts) in enumerate(items):
+            if self.stopped:
+                with self.lock:
+                    self.queued.extend(items[i:])
+                self.save()
+                return
+            attempts = attempts[0] + 1 if attempts else 1
+            try:
+                files = self.download_subtitle(id, name, path)
+            except Exception as e:
+                if attempts >= self.retries:
+                    logger.error(f"OpenSubtitles - dropped queued '{name}': {e}")
+                else:
+                    self.queue_subtitle(id, name, path, attempts)
+                continue
+            if files and self.on_download:
+                self.on_download(id, files[id])
@@ -1,12 +1,104 @@
-from pythonopensubtitles.opensubtitles import OpenSubtitles
-from opensubtitles_v2 import OpenSubtitlesV2
-from rarbgapi import RarbgAPI
+from infohash import from_magnet
+from resilience import breaker
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from contextlib import closing
+from datetime import datetime
+from logging import getLogger
+from threading import Lock
+from time import time
+from urllib.parse import quote
+import sqlite3
 import subprocess
 import json
 
+logger = getLogger("rich")
+
+PROVIDERS = {}
+TRACKERS = [
+    "udp://tracker.opentrackr.org:1337/announce",
+    "udp://open.stealth.si:80/announce",
+    "udp://tracker.torrent.eu.org:451/announce",
+    "udp://exodus.desync.com:6969/announce",
+]
+
+
+def provider(name):
+    def register(cls):
+        cls.name = name
+        PROVIDERS[name] = cls
+        return cls
+
+    return register
+
+
+class SearchCache:
+    def __init__(self, path=None, size=256, ttl=6 * 60 * 60, negative_ttl=15 * 60):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.items = OrderedDict()
+        self.lock = Lock()
+        if self.path:
+            with closing(sqlite3.connect(self.path)) as db, db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, value TEXT)"
+                )
+                db.execute("DELETE FROM cache WHERE expires < ?", (time(),))
+
+    def key(self, provider, query, lang="", category=""):
+        return json.dumps([provider, " ".join(query.lower().split()), lang, category])
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                expires, value = self.items[key]
+                if expires > time():
+                    self.items.move_to_end(key)
+                    return True, value
+                del self.items[key]
+        if self.path:
+            with closing(sqlite3.connect(self.path)) as db:
+                row = db.execute(
+                    "SELECT expires, value FROM cache WHERE key = ? AND expires > ?",
+                    (key, time()),
+                ).fetchone()
+            if row:
+                self.remember(key, row[0], json.loads(row[1]))
+                return True, json.loads(row[1])
+        return False, None
+
+    def set(self, key, value):
+        expires = time() + (self.ttl if value else self.negative_ttl)
+        self.remember(key, expires, value)
+        if self.path:
+            with closing(sqlite3.connect(self.path)) as db, db:
+                db.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                    (key, expires, json.dumps(value)),
+                )
+
+    def remember(self, key, expires, value):
+        with self.lock:
+            self.items[key] = (expires, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def cached(self, provider, fetch, query, lang="", category="", **kwargs):
+        key = self.key(provider, query, lang, category)
+        hit, value = self.get(key)
+        if not hit:
+            value = fetch(query, **kwargs)
+            self.set(key, value)
+        return value
+
 
 class SubtitlesSearch:
     def __init__(self, user, password):
+        from pythonopensubtitles.opensubtitles import OpenSubtitles
+
         self.api = OpenSubtitles()
         self.api.login(user, password)
 
@@ -31,13 +123,42 @@ class SubtitlesSearch:
 
 
 class SubtitlesSearchV2:
-    def __init__(self, user, password, apikey):
-        self.api = OpenSubtitlesV2()
+    def __init__(self, user, password, apikey, token_cache=None, search_cache=None):
+        from opensubtitles_v2 import OpenSubtitlesV2
+
+        self.api = OpenSubtitlesV2(token_cache)
         self.api.login(user, password, apikey)
+        self.search_cache = search_cache
+        self.search_breaker = breaker("OpenSubtitles search")
+        self.download_breaker = breaker("OpenSubtitles download", retries=1)
 
-    def query(self, query, lang="fre", max_results=5):
+    def query(self, query, lang="fre", max_results=5, moviehash=None):
+        if self.search_cache:
+            return self.search_cache.cached(
+                "opensubtitles",
+                self.fetch,
+                query,
+                lang=lang,
+                category=f"{max_results}:{moviehash or ''}",
+                max_results=max_results,
+                moviehash=moviehash,
+            )
+        return self.fetch(
+            query, lang=lang, max_results=max_results, moviehash=moviehash
+        )
+
+    def fetch(self, query, lang="fre", max_results=5, moviehash=None):
         lang = lang[:2]
-        subtitles = self.api.search_subtitles(query, lang)
+        subtitles = None
+        if moviehash:
+            subtitles = self.search_breaker.call(
+                self.api.search_subtitles, query, lang, moviehash
+            )
+            if subtitles:
+                match = lambda sub: sub["attributes"].get("moviehash_match")
+                subtitles.sort(key=lambda sub: not match(sub))
+        if not subtitles:
+            subtitles = self.search_breaker.call(self.api.search_subtitles, query, lang)
         if subtitles:
             remap = lambda sub: dict(
                 id=sub["attributes"]["files"][0]["file_id"],
@@ -49,39 +170,156 @@ class SubtitlesSearchV2:
                 ext="srt",
             )
             return list(map(remap, subtitles[:max_results]))
+        return []
 
     def download(self, sub, name, path):
         id, name = sub["id"], f"{name}.{sub['ext']}"
-        return self.api.download_subtitle(id, name, path)
+        return self.download_breaker.call(self.api.download_subtitle, id, name, path)
 
+    def download_batch(self, items):
+        return self.download_breaker.call(
+            self.api.download_subtitles,
+            [(sub["id"], f"{name}.{sub['ext']}", path) for sub, name, path in items],
+        )
 
-class TorrentSearch:
+    def queue(self, sub, name, path):
+        self.api.queue_subtitle(sub["id"], f"{name}.{sub['ext']}", path)
+
+    def is_queued(self, sub):
+        return any(item[0] == sub["id"] for item in self.api.queued)
+
+    def remaining(self):
+        self.api.ensure_login()
+        return self.api.user_downloads_remaining or 0
+
+    def stop(self):
+        self.api.stop()
+
+
+@provider("rarbg")
+class RarbgProvider:
     CATEGORIES = [14, 48, 17, 44, 45, 50, 51, 52, 54, 42, 46, 18, 41, 49]
+    deadline = 10
 
     def __init__(self):
+        from rarbgapi import RarbgAPI
+
         self.api = RarbgAPI()
 
-    def query(self, query, min_seeders=5, max_results=5):
+    def search(self, query, limit=10):
         torrents = self.api.search(
             search_string=query,
             extended_response=True,
             sort="seeders",
             categories=self.CATEGORIES,
-            limit=10,
+            limit=limit,
         )
-        filt = lambda t: t.seeders > min_seeders
         remap = lambda t: dict(
             name=t.filename,
             seeders=t.seeders,
             leechers=t.leechers,
-            size=round(t.size / 2**30, 2),
+            size=t.size,
             category=t.category,
             date=t.pubdate[:-6],
             magnet=t.download,
+            hash=from_magnet(t.download),
+        )
+        return list(map(remap, torrents))
+
+
+@provider("apibay")
+class ApibayProvider:
+    API = "https://apibay.org/q.php"
+    CATEGORY = 200
+    deadline = 10
+
+    def __init__(self):
+        import requests
+
+        self.session = requests.Session()
+        self.session.headers.update({"user-agent": "Mediagram v1"})
+
+    def search(self, query, limit=10):
+        response = self.session.get(
+            self.API, params=dict(q=query, cat=self.CATEGORY), timeout=self.deadline
+        )
+        response.raise_for_status()
+        torrents = [t for t in response.json() if t.get("id") != "0"]
+        trackers = "".join(f"&tr={quote(tr)}" for tr in TRACKERS)
+        remap = lambda t: dict(
+            name=t["name"],
+            seeders=int(t["seeders"]),
+            leechers=int(t["leechers"]),
+            size=int(t["size"]),
+            category=t["category"],
+            date=datetime.fromtimestamp(int(t["added"])).strftime("%Y-%m-%d %H:%M:%S"),
+            magnet=f"magnet:?xt=urn:btih:{t['info_hash']}&dn={quote(t['name'])}"
+            + trackers,
+            hash=t["info_hash"].lower(),
         )
-        filtered = filter(filt, torrents)
-        remapped = list(map(remap, filtered))
-        return remapped[:max_results]
+        return list(map(remap, torrents[:limit]))
+
+
+class TorrentSearch:
+    def __init__(self, search_cache=None, providers=None, concurrency=4):
+        if providers is None:
+            providers = list(PROVIDERS)
+        self.providers = []
+        for p in providers:
+            if not isinstance(p, str):
+                self.providers.append(p)
+            elif p not in PROVIDERS:
+                logger.warning(f"TorrentSearch - unknown provider '{p}', skipped")
+            else:
+                try:
+                    self.providers.append(PROVIDERS[p]())
+                except Exception as e:
+                    logger.warning(f"TorrentSearch - provider '{p}' unavailable: {e}")
+        self.search_cache = search_cache
+        self.pool = ThreadPoolExecutor(
+            max(len(self.providers), 1) * concurrency, thread_name_prefix="search"
+        )
+
+    def query(self, query, min_seeders=5, max_results=5):
+        if not self.search_cache:
+            return self.gather(query, min_seeders, max_results)[0]
+        names = ",".join(p.name for p in self.providers)
+        key = self.search_cache.key(
+            "torrents", query, category=f"{names}:{min_seeders}:{max_results}"
+        )
+        hit, torrents = self.search_cache.get(key)
+        if not hit:
+            torrents, complete = self.gather(query, min_seeders, max_results)
+            if complete:
+                self.search_cache.set(key, torrents)
+        return torrents
+
+    def gather(self, query, min_seeders=5, max_results=5):
+        start = time()
+        futures = []
+        for p in self.providers:
+            guard = breaker(f"Search {p.name}", retries=1)
+            futures.append((p, self.pool.submit(guard.call, p.search, query)))
+        merged, complete = {}, True
+        for p, future in futures:
+            try:
+                torrents = future.result(timeout=max(p.deadline - (time() - start), 0))
+            except TimeoutError:
+                logger.warning(f"TorrentSearch - {p.name} missed its deadline")
+                complete = False
+                continue
+            except Exception as e:
+                logger.warning(f"TorrentSearch - {p.name} failed: {e}")
+                complete = False
+                continue
+            for t in torrents:
+                best = merged.get(t["hash"])
+                if not best or t["seeders"] > best["seeders"]:
+                    merged[t["hash"]] = t
+        ranked = sorted(merged.values(), key=lambda t: t["seeders"], reverse=True)
+        remap = lambda t: dict(t, size=round(t["size"] / 2**30, 2))
+        filtered = [remap(t) for t in ranked if t["seeders"] > min_seeders]
+        return filtered[:max_results], complete
 
 
 def get_public_ip():
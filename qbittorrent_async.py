@@ -0,0 +1,94 @@
+import aiohttp
+
+
+class AsyncClient:
+    def __init__(self, url, limit=4, timeout=30):
+        if not url.endswith("/"):
+            url += "/"
+        self.url = url + "api/v2/"
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit),
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        )
+
+    async def _request(self, method, endpoint, **kwargs):
+        async with self.session.request(
+            method, self.url + endpoint, **kwargs
+        ) as response:
+            response.raise_for_status()
+            if response.content_type == "application/json":
+                return await response.json()
+            return await response.text()
+
+    async def _get(self, endpoint, **params):
+        return await self._request("GET", endpoint, params=params)
+
+    async def _post(self, endpoint, data=None):
+        return await self._request("POST", endpoint, data=data)
+
+    async def login(self, username, password):
+        return await self._post(
+            "auth/login", data=dict(username=username or "", password=password or "")
+        )
+
+    async def logout(self):
+        return await self._post("auth/logout")
+
+    async def close(self):
+        await self.session.close()
+
+    async def shutdown(self):
+        return await self._post("app/shutdown")
+
+    async def torrents(self, **filters):
+        return await self._get("torrents/info", **filters)
+
+    async def sync_main_data(self, rid=0):
+        return await self._get("sync/maindata", rid=rid)
+
+    async def download_from_link(self, link, save_path=None):
+        data = dict(urls=link)
+        if save_path:
+            data["savepath"] = save_path
+        return await self._post("torrents/add", data=data)
+
+    async def download_from_file(self, file_buffer, save_path=None):
+        data = aiohttp.FormData()
+        data.add_field(
+            "torrents",
+            file_buffer,
+            filename="upload.torrent",
+            content_type="application/x-bittorrent",
+        )
+        if save_path:
+            data.add_field("savepath", save_path)
+        return await self._post("torrents/add", data=data)
+
+    async def toggle_sequential_download(self, infohash_list):
+        return await self._post(
+            "torrents/toggleSequentialDownload", data=dict(hashes=infohash_list)
+        )
+
+    async def toggle_first_last_piece_priority(self, infohash_list):
+        return await self._post(
+            "torrents/toggleFirstLastPiecePrio", data=dict(hashes=infohash_list)
+        )
+
+    async def set_location(self, infohash_list, location):
+        return await self._post(
+            "torrents/setLocation", data=dict(hashes=infohash_list, location=location)
+        )
+
+    async def delete(self, infohash_list):
+        return await self._post(
+            "torrents/delete", data=dict(hashes=infohash_list, deleteFiles="false")
+        )
+
+    async def delete_permanently(self, infohash_list):
+        return await self._post(
+            "torrents/delete", data=dict(hashes=infohash_list, deleteFiles="true")
+        )
+
+    async def delete_all_permanently(self):
+        return await self.delete_permanently("all")
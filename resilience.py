@@ -0,0 +1,135 @@
+import asyncio
+import random
+from threading import Lock
+from time import time as now, sleep
+from logging import getLogger
+
+logger = getLogger("rich")
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def backoff(attempt, base=0.5, cap=30):
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class Breaker:
+    def __init__(
+        self,
+        name,
+        threshold=5,
+        cooldown=30,
+        retries=3,
+        base=0.5,
+        cap=8,
+        ignore=(),
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.ignore = ignore
+        self.failures = 0
+        self.opened = 0
+        self.lock = Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.failures < self.threshold:
+                return True
+            if now() - self.opened >= self.cooldown:
+                self.opened = now()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            if self.failures >= self.threshold:
+                logger.info(f"{self.name} - recovered")
+            self.failures = 0
+
+    def failure(self, error):
+        with self.lock:
+            self.failures += 1
+            if self.failures == self.threshold:
+                self.opened = now()
+                logger.warning(
+                    f"{self.name} - circuit open for {self.cooldown}s: {error}"
+                )
+
+    def attempts(self, retries):
+        for attempt in range(retries):
+            if not self.allow():
+                raise CircuitOpen(f"{self.name} unavailable")
+            yield attempt, attempt == retries - 1
+
+    def call(self, fn, *args, **kwargs):
+        return self.invoke(fn, args, kwargs, self.retries)
+
+    async def acall(self, fn, *args, **kwargs):
+        return await self.ainvoke(fn, args, kwargs, self.retries)
+
+    def invoke(self, fn, args, kwargs, retries):
+        for attempt, last in self.attempts(retries):
+            try:
+                result = fn(*args, **kwargs)
+            except self.ignore:
+                raise
+            except Exception as e:
+                self.failure(e)
+                if last:
+                    raise
+                sleep(backoff(attempt, self.base, self.cap))
+            else:
+                self.success()
+                return result
+
+    async def ainvoke(self, fn, args, kwargs, retries):
+        for attempt, last in self.attempts(retries):
+            try:
+                result = await fn(*args, **kwargs)
+            except self.ignore:
+                raise
+            except Exception as e:
+                self.failure(e)
+                if last:
+                    raise
+                await asyncio.sleep(backoff(attempt, self.base, self.cap))
+            else:
+                self.success()
+                return result
+
+
+class Guarded:
+    def __init__(self, target, breaker, once=()):
+        self.target = target
+        self.breaker = breaker
+        self.once = once
+
+    def __getattr__(self, name):
+        attr = getattr(self.target, name)
+        retries = 1 if name in self.once else self.breaker.retries
+        if asyncio.iscoroutinefunction(attr):
+            return lambda *args, **kwargs: self.breaker.ainvoke(
+                attr, args, kwargs, retries
+            )
+        if callable(attr):
+            return lambda *args, **kwargs: self.breaker.invoke(
+                attr, args, kwargs, retries
+            )
+        return attr
+
+
+BREAKERS = {}
+lock = Lock()
+
+
+def breaker(name, **kwargs):
+    with lock:
+        if name not in BREAKERS:
+            BREAKERS[name] = Breaker(name, **kwargs)
+        return BREAKERS[name]
@@ -0,0 +1,97 @@
+import os
+from os import path
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from logging import getLogger
+
+logger = getLogger("rich")
+
+VIDEO = (".mkv", ".mp4", ".avi", ".m4v", ".mov", ".wmv", ".ts", ".webm")
+
+
+class SubtitlesFetcher:
+    def __init__(self, searcher, languages, workers=3, hasher=None, on_done=None):
+        self.searcher = searcher
+        self.languages = languages
+        self.workers = workers
+        self.hasher = hasher
+        self.on_done = on_done
+        self.inflight = 0
+        self.lock = Lock()
+        self.pool = None
+
+    def start(self):
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="subtitles")
+
+    def stop(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def videos(self, target):
+        if not path.isdir(target):
+            return [target] if target.lower().endswith(VIDEO) else []
+        return sorted(
+            path.join(folder, name)
+            for folder, _, names in os.walk(target)
+            for name in names
+            if name.lower().endswith(VIDEO)
+        )
+
+    def fetch(self, target, **meta):
+        jobs = []
+        for video in self.videos(target):
+            stem = path.splitext(video)[0]
+            for i, lang in enumerate(self.languages):
+                name = stem if i == 0 else f"{stem}.{lang}"
+                if not path.exists(f"{name}.srt"):
+                    jobs.append((video, lang, name))
+        if not jobs or not self.pool:
+            return False
+        batch = dict(meta=meta, pending=len(jobs), results=[])
+        for job in jobs:
+            self.pool.submit(self.run, batch, *job)
+        logger.info(f"Subtitles - {len(jobs)} queued: '{target}'")
+        return True
+
+    def run(self, batch, video, lang, name):
+        try:
+            added = self.download(video, lang, name)
+        except Exception as e:
+            logger.error(f"Subtitles - failed: '{video}' ({lang}): {e}")
+            added = False
+        with self.lock:
+            batch["results"].append((video, lang, added))
+            batch["pending"] -= 1
+            last = not batch["pending"]
+        if last and self.on_done:
+            self.on_done(batch["results"], **batch["meta"])
+
+    def download(self, video, lang, name):
+        moviehash = None
+        if self.hasher:
+            try:
+                moviehash = self.hasher(video)
+            except OSError:
+                pass
+        query = path.splitext(path.basename(video))[0]
+        subtitles = self.searcher.query(query, lang, moviehash=moviehash)
+        if not subtitles:
+            return False
+        folder, base = path.split(name)
+        remaining = self.searcher.remaining()
+        with self.lock:
+            exhausted = remaining - self.inflight <= 0
+            if not exhausted:
+                self.inflight += 1
+        if exhausted:
+            self.searcher.queue(subtitles[0], base, folder)
+            logger.warning(f"Subtitles - quota exhausted, queued: '{video}'")
+            return None
+        try:
+            if self.searcher.download(subtitles[0], base, folder):
+                return True
+            return None if self.searcher.is_queued(subtitles[0]) else False
+        finally:
+            with self.lock:
+                self.inflight -= 1
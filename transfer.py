@@ -0,0 +1,278 @@
+import os
+import json
+import errno
+from os import path
+from shutil import rmtree
+from hashlib import blake2b
+from queue import Queue, Empty
+from threading import Thread, Event, Lock, get_native_id
+from subprocess import run
+from time import time as now
+from logging import getLogger
+
+logger = getLogger("rich")
+
+FALLBACK_ERRORS = [
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.EBADF,
+]
+
+
+class Interrupted(Exception):
+    pass
+
+
+def checksum(file, size, samples=16, block=2**20):
+    digest = blake2b(digest_size=16)
+    fd = os.open(file, os.O_RDONLY)
+    try:
+        span = max(size - block, 0)
+        for i in range(samples):
+            offset = span * i // (samples - 1)
+            digest.update(os.pread(fd, block, offset))
+    finally:
+        os.close(fd)
+    return digest.hexdigest()
+
+
+class Mover:
+    def __init__(self, journal, chunk=8 * 2**20, on_progress=None, on_done=None):
+        self.journal = journal
+        self.chunk = chunk
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.jobs = {}
+        self.queue = Queue()
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.methods = [self.sendfile, self.pwrite]
+        if hasattr(os, "copy_file_range"):
+            self.methods.insert(0, self.copy_file_range)
+
+    def start(self):
+        if path.exists(self.journal):
+            with open(self.journal) as f:
+                self.jobs = json.load(f)
+        for job in self.jobs.values():
+            logger.info(f"Mover - resuming: '{job['pairs'][0][0]}'")
+            self.queue.put(job["id"])
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def submit(self, pairs, **meta):
+        job = dict(id=blake2b(pairs[0][0].encode(), digest_size=8).hexdigest())
+        job.update(pairs=pairs, meta=meta)
+        with self.lock:
+            if job["id"] in self.jobs:
+                return None
+            self.jobs[job["id"]] = job
+            self.save()
+        self.queue.put(job["id"])
+        return job
+
+    def save(self):
+        temp = f"{self.journal}.tmp"
+        with open(temp, "w") as f:
+            json.dump(self.jobs, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.journal)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                job = self.jobs[self.queue.get(timeout=1)]
+            except Empty:
+                continue
+            try:
+                self.move(job)
+                error = None
+            except Interrupted:
+                return
+            except Exception as e:
+                error = e
+                logger.error(f"Mover - failed: '{job['pairs'][0][0]}': {e}")
+            with self.lock:
+                self.jobs.pop(job["id"], None)
+                self.save()
+            if self.on_done:
+                self.on_done(job, error)
+
+    def move(self, job):
+        pairs = [(s, d) for s, d in job["pairs"] if path.exists(s)]
+        if not pairs:
+            raise FileNotFoundError(job["pairs"][0][0])
+        if all(self.same_device(s, d) for s, d in pairs):
+            for src, dst in pairs:
+                os.rename(src, dst)
+            return
+        files = [f for src, dst in pairs for f in self.walk(src, dst)]
+        try:
+            self.transfer(job, files)
+        except Interrupted:
+            raise
+        except Exception:
+            self.discard(files)
+            raise
+        for src, _ in pairs:
+            if path.isdir(src):
+                rmtree(src)
+            else:
+                os.remove(src)
+
+    def transfer(self, job, files):
+        total = sum(size for _, _, size in files)
+        done, last = 0, 0
+        for src, dst, size in files:
+            for copied in self.copy(src, dst, size):
+                if self.on_progress and now() - last >= 1:
+                    self.on_progress(job, done + copied, total)
+                    last = now()
+            done += size
+        for src, dst, size in files:
+            if os.path.getsize(dst) != size:
+                raise IOError(f"Size mismatch: '{dst}'")
+            if checksum(src, size) != checksum(dst, size):
+                raise IOError(f"Checksum mismatch: '{dst}'")
+
+    def discard(self, files):
+        for _, dst, _ in files:
+            try:
+                os.remove(dst)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Mover - cannot discard '{dst}': {e}")
+
+    def same_device(self, src, dst):
+        return os.stat(src).st_dev == os.stat(path.dirname(dst)).st_dev
+
+    def walk(self, src, dst):
+        if not path.isdir(src):
+            return [(src, dst, path.getsize(src))]
+        files = []
+        for folder, _, names in os.walk(src):
+            target = path.join(dst, path.relpath(folder, src))
+            os.makedirs(target, exist_ok=True)
+            for name in names:
+                file = path.join(folder, name)
+                files.append((file, path.join(target, name), path.getsize(file)))
+        return files
+
+    def copy(self, src, dst, size):
+        offset = path.getsize(dst) if path.exists(dst) else 0
+        with open(src, "rb") as fin, open(dst, "r+b" if offset else "wb") as fout:
+            if offset > size:
+                fout.truncate(0)
+                offset = 0
+            while offset < size:
+                if self.stopped.is_set():
+                    raise Interrupted()
+                n = self.copy_range(fin.fileno(), fout.fileno(), offset)
+                if n == 0:
+                    raise IOError(f"Unexpected end of file: '{src}'")
+                offset += n
+                yield offset
+
+    def copy_range(self, fin, fout, offset):
+        while True:
+            method = self.methods[0]
+            try:
+                return method(fin, fout, offset)
+            except OSError as e:
+                if len(self.methods) == 1 or e.errno not in FALLBACK_ERRORS:
+                    raise
+                logger.debug(f"Mover - {method.__name__} unsupported: {e}")
+                self.methods.pop(0)
+
+    def copy_file_range(self, fin, fout, offset):
+        return os.copy_file_range(fin, fout, self.chunk, offset, offset)
+
+    def sendfile(self, fin, fout, offset):
+        os.lseek(fout, offset, os.SEEK_SET)
+        return os.sendfile(fout, fin, offset, self.chunk)
+
+    def pwrite(self, fin, fout, offset):
+        return os.pwrite(fout, os.pread(fin, self.chunk, offset), offset)
+
+
+class Trash:
+    def __init__(self, roots, folder=".trash", on_done=None):
+        self.roots = [root for root in roots if root]
+        self.folder = folder
+        self.on_done = on_done
+        self.queue = Queue()
+        self.stopped = Event()
+        self.thread = None
+
+    def start(self):
+        for root in self.roots:
+            trash = path.join(root, self.folder)
+            if path.isdir(trash):
+                for name in os.listdir(trash):
+                    self.queue.put((path.join(trash, name), root, {}))
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def delete(self, file, root, **meta):
+        trash = path.join(root, self.folder)
+        os.makedirs(trash, exist_ok=True)
+        target = path.join(trash, f"{int(now() * 1000)}-{path.basename(file)}")
+        os.rename(file, target)
+        self.queue.put((target, root, meta))
+        return target
+
+    def low_priority(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, get_native_id(), 19)
+            run(["ionice", "-c", "3", "-p", str(get_native_id())], check=True)
+        except Exception as e:
+            logger.debug(f"Trash - low priority unavailable: {e}")
+
+    def run(self):
+        self.low_priority()
+        while not self.stopped.is_set():
+            try:
+                target, root, meta = self.queue.get(timeout=1)
+            except Empty:
+                continue
+            try:
+                size = self.unlink(target)
+                logger.info(f"Trash - {size} bytes reclaimed: '{target}'")
+            except Exception as e:
+                logger.error(f"Trash - failed: '{target}': {e}")
+                continue
+            if self.on_done:
+                self.on_done(root, size, meta)
+
+    def unlink(self, target):
+        if not path.isdir(target):
+            size = os.lstat(target).st_size
+            os.remove(target)
+            return size
+        size = 0
+        for folder, dirs, names in os.walk(target, topdown=False):
+            for name in names:
+                file = path.join(folder, name)
+                size += os.lstat(file).st_size
+                os.remove(file)
+            for name in dirs:
+                os.rmdir(path.join(folder, name))
+        os.rmdir(target)
+        return size
@@ -0,0 +1,101 @@
+import hmac
+from queue import Queue, Full
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import time as now
+from logging import getLogger
+from telebot import types
+
+logger = getLogger("rich")
+
+
+class WebhookServer:
+    def __init__(
+        self, bot, secret, host="0.0.0.0", port=8443, path="/", workers=4, size=100
+    ):
+        self.bot = bot
+        self.secret = secret.encode()
+        self.host = host
+        self.port = port
+        self.path = path
+        self.workers = workers
+        self.queue = Queue(size)
+        self.server = None
+        self.threads = []
+        self.updates = 0
+        self.delay = 0
+        self.lock = Lock()
+
+    def serve(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), self.handler())
+        self.server.daemon_threads = True
+        logger.info(f"Webhook - listening on {self.host}:{self.port}{self.path}")
+        self.threads = [
+            Thread(target=self.work, daemon=True) for _ in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            for _ in self.threads:
+                self.queue.put(None)
+            with self.lock:
+                average = self.delay / self.updates * 1000 if self.updates else 0
+                logger.info(
+                    f"Webhook - stopped, {self.updates} updates, "
+                    f"{average:.1f} ms average dispatch delay"
+                )
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    def accept(self, path, token, body):
+        if path != self.path or not hmac.compare_digest(token.encode(), self.secret):
+            return 403
+        try:
+            update = types.Update.de_json(body.decode())
+        except (ValueError, KeyError, TypeError):
+            return 400
+        try:
+            self.queue.put_nowait((now(), update))
+        except Full:
+            logger.warning("Webhook - queue full, update deferred to Telegram")
+            return 503
+        return 200
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            received, update = item
+            with self.lock:
+                self.updates += 1
+                self.delay += now() - received
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                logger.error(f"Webhook - update {update.update_id} failed: {e}")
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                code = server.accept(
+                    self.path,
+                    self.headers.get("X-Telegram-Bot-Api-Secret-Token", ""),
+                    self.rfile.read(length),
+                )
+                self.send_response(code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler